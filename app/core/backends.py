@@ -0,0 +1,554 @@
+"""
+Storage backends for session entries and session metadata
+
+SessionStore keeps images and templates on disk itself and delegates entry
+and session-metadata persistence to one of these backends:
+
+- ``files``: the JSONL entry journal plus ``session.json`` (default)
+- ``sqlite``: ``metadata/session.db`` in WAL mode, with order, timestamp and
+  location_type in indexed columns so sorting, filtering and counting run
+  as queries
+"""
+from pathlib import Path
+import json
+import os
+import shutil
+import sqlite3
+from datetime import datetime
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from app.core.models import Entry, EntryHeader, stamp
+from app.core.journal import EntryJournal, JOURNAL_NAME, SNAPSHOT_NAME, encode_entry
+
+SESSION_FILE = "session.json"
+SQLITE_FILE = "session.db"
+DEFAULT_BACKEND = "files"
+
+LOCATION_TYPES = ("web", "app", "mobile", "other")
+
+
+def entry_sort_key(entry):
+    """Display order: explicit order first, then unordered (0) by timestamp
+
+    Works on Entry and EntryHeader alike.
+    """
+    return (entry.order <= 0, entry.order, entry.timestamp, entry.id)
+
+
+def _move_aside(paths: List[Path]) -> None:
+    """Rename existing files to <name>.<timestamp>.bak as one set
+
+    The suffix is unique to this call, so converting a session back and
+    forth never overwrites the backups of an earlier conversion.
+    """
+    paths = [p for p in paths if p.exists()]
+    base = datetime.now().strftime("%Y%m%d-%H%M%S")
+    suffix, n = f".{base}.bak", 1
+    while any(p.with_name(p.name + suffix).exists() for p in paths):
+        n += 1
+        suffix = f".{base}-{n}.bak"
+    for path in paths:
+        os.replace(path, path.with_name(path.name + suffix))
+
+
+def _dump(entry: Entry) -> dict:
+    """Stored form of an entry, stamped with the schema version"""
+    try:
+        return stamp(entry.model_dump())
+    except AttributeError:
+        return stamp(entry.dict())
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    """Write a file via temp file + fsync + rename so readers never see it torn"""
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+@dataclass
+class BatchChanges:
+    """Entry and metadata mutations committed together by StorageBackend.apply()
+
+    Applied in the order puts, orders, deletes. Whoever fills it in keeps the
+    three collections disjoint (SessionStore.batch() does).
+    """
+    puts: Dict[str, Entry] = field(default_factory=dict)
+    orders: Dict[str, int] = field(default_factory=dict)
+    deletes: Set[str] = field(default_factory=set)
+    metadata: Optional[dict] = None
+
+    def is_empty(self) -> bool:
+        return not (self.puts or self.orders or self.deletes or self.metadata is not None)
+
+
+class StorageBackend:
+    """Interface for persisting a session's entries and metadata"""
+
+    name = ""
+
+    def __init__(self, meta_dir: Path):
+        self.meta = Path(meta_dir)
+
+    @classmethod
+    def detect(cls, meta_dir: Path) -> bool:
+        """True if meta_dir holds data written by this backend"""
+        raise NotImplementedError
+
+    def load_metadata(self) -> Optional[dict]:
+        raise NotImplementedError
+
+    def headers(self, location_type: Optional[str] = None) -> List[EntryHeader]:
+        """Entry headers in display order, optionally filtered by location type"""
+        raise NotImplementedError
+
+    def get_entry(self, entry_id: str) -> Optional[Entry]:
+        """The full Entry for an id, or None"""
+        raise NotImplementedError
+
+    def all_entries(self, location_type: Optional[str] = None) -> List[Entry]:
+        """Entries in display order, optionally filtered by location type"""
+        raise NotImplementedError
+
+    def count_by_location_type(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def max_order(self) -> int:
+        raise NotImplementedError
+
+    def apply(self, changes: BatchChanges) -> None:
+        """Durably commit a set of mutations as one unit"""
+        raise NotImplementedError
+
+    def compact(self) -> None:
+        """Reclaim space from superseded records (optional)"""
+
+    def retire(self) -> None:
+        """Move this backend's files aside after converting the session"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class FileBackend(StorageBackend):
+    """Entry journal + session.json, with an in-memory entry table.
+
+    The table is built by replaying the journal once, then kept in sync by
+    our own mutations; records appended by another writer are replayed on
+    the next read. It holds an EntryHeader and the compact JSON of every
+    entry; full Entry objects are only built when asked for.
+    """
+
+    name = "files"
+
+    def __init__(self, meta_dir: Path):
+        super().__init__(meta_dir)
+        self._headers: Dict[str, EntryHeader] = {}
+        self._raw: Dict[str, bytes] = {}
+        self._cache: Dict[str, Entry] = {}
+        # Entries whose order changed after their raw JSON was captured
+        self._order_stale: Set[str] = set()
+        self._sorted: Optional[List[EntryHeader]] = None
+        self._journal = EntryJournal(self.meta)
+        self._open_journal()
+
+    @classmethod
+    def detect(cls, meta_dir: Path) -> bool:
+        return EntryJournal(meta_dir).exists()
+
+    def load_metadata(self) -> Optional[dict]:
+        metadata_file = self.meta / SESSION_FILE
+        if not metadata_file.exists():
+            return None
+        return json.loads(metadata_file.read_text(encoding="utf-8"))
+
+    def headers(self, location_type: Optional[str] = None) -> List[EntryHeader]:
+        self._refresh()
+        if self._sorted is None:
+            self._sorted = sorted(self._headers.values(), key=entry_sort_key)
+        if location_type is None:
+            return list(self._sorted)
+        return [h for h in self._sorted if h.location_type == location_type]
+
+    def get_entry(self, entry_id: str) -> Optional[Entry]:
+        self._refresh()
+        return self._materialize(entry_id)
+
+    def all_entries(self, location_type: Optional[str] = None) -> List[Entry]:
+        return [self._materialize(h.id) for h in self.headers(location_type)]
+
+    def count_by_location_type(self) -> Dict[str, int]:
+        self._refresh()
+        counts = dict.fromkeys(LOCATION_TYPES, 0)
+        for header in self._headers.values():
+            key = header.location_type if header.location_type in counts else "other"
+            counts[key] += 1
+        return counts
+
+    def max_order(self) -> int:
+        self._refresh()
+        return max((h.order for h in self._headers.values()), default=0)
+
+    def apply(self, changes: BatchChanges) -> None:
+        """One journal append (single write + fsync) for all entry changes,
+        then session.json via temp file + rename"""
+        self._refresh()
+        records = [{"op": "put", "entry": _dump(e)} for e in changes.puts.values()]
+        orders = {k: v for k, v in changes.orders.items() if k in self._headers}
+        if orders:
+            records.append({"op": "order", "orders": orders})
+        records.extend({"op": "delete", "id": i} for i in changes.deletes)
+        self._journal.append(records)
+
+        for record, entry in zip(records, changes.puts.values()):
+            self._put(record["entry"], encode_entry(record["entry"]))
+            self._cache[entry.id] = entry
+        self._set_orders(orders)
+        for entry_id in changes.deletes:
+            self._remove(entry_id)
+        if records:
+            self._sorted = None
+            self._maybe_compact()
+
+        if changes.metadata is not None:
+            self.meta.mkdir(exist_ok=True, parents=True)  # Ensure directory exists
+            atomic_write_text(self.meta / SESSION_FILE, json.dumps(stamp(dict(changes.metadata)), indent=2))
+
+    def compact(self) -> None:
+        self._refresh()
+        self._journal.compact(self._snapshot_lines())
+
+    def retire(self) -> None:
+        _move_aside([self.meta / name for name in (JOURNAL_NAME, SNAPSHOT_NAME, SESSION_FILE)])
+
+    def _materialize(self, entry_id: str) -> Optional[Entry]:
+        """Build (once) the full Entry for an id from its raw JSON"""
+        entry = self._cache.get(entry_id)
+        if entry is None and entry_id in self._raw:
+            entry = Entry.from_stored(self._raw[entry_id])
+            entry.order = self._headers[entry_id].order
+            self._cache[entry_id] = entry
+        return entry
+
+    def _put(self, data: dict, raw: bytes) -> None:
+        entry_id = data["id"]
+        self._headers[entry_id] = EntryHeader.from_dict(data)
+        self._raw[entry_id] = raw
+        self._cache.pop(entry_id, None)
+        self._order_stale.discard(entry_id)
+
+    def _set_orders(self, orders: Dict[str, int]) -> None:
+        for entry_id, order in orders.items():
+            header = self._headers.get(entry_id)
+            if header is None:
+                continue
+            header.order = order
+            self._order_stale.add(entry_id)
+            if entry_id in self._cache:
+                self._cache[entry_id].order = order
+
+    def _remove(self, entry_id: str) -> None:
+        self._headers.pop(entry_id, None)
+        self._raw.pop(entry_id, None)
+        self._cache.pop(entry_id, None)
+        self._order_stale.discard(entry_id)
+
+    def _snapshot_lines(self) -> List[bytes]:
+        """Compact JSON of every live entry, folding in pending order changes"""
+        for entry_id in self._order_stale:
+            data = json.loads(self._raw[entry_id])
+            data["order"] = self._headers[entry_id].order
+            self._raw[entry_id] = encode_entry(data)
+        self._order_stale.clear()
+        return list(self._raw.values())
+
+    def _open_journal(self) -> None:
+        """Load entries from the journal, migrating a legacy session first"""
+        if not self._journal.exists():
+            self._migrate_legacy_metadata()
+
+        snapshot, records = self._journal.load()
+        self._headers = {}
+        self._raw = {}
+        self._cache = {}
+        self._order_stale = set()
+        for line in snapshot:
+            self._put(json.loads(line), line)
+        self._apply_records(records)
+        self._sorted = None
+        self._maybe_compact()
+
+    def _migrate_legacy_metadata(self) -> None:
+        """Fold pre-journal per-entry metadata/<id>.json files into a snapshot
+
+        The old files are moved to metadata/legacy/ once the snapshot is safely
+        on disk, so the migration runs only once per session.
+        """
+        if not self.meta.exists():
+            return
+        legacy = [p for p in sorted(self.meta.glob("*.json")) if p.name != SESSION_FILE]
+        if not legacy:
+            return
+
+        entries = []
+        for p in legacy:
+            with open(p, "r", encoding="utf-8") as f:
+                entries.append(_dump(Entry(**json.load(f))))
+        self._journal.compact(entries)
+
+        backup_dir = self.meta / "legacy"
+        backup_dir.mkdir(exist_ok=True)
+        for p in legacy:
+            shutil.move(str(p), str(backup_dir / p.name))
+
+    def _apply_records(self, records: List[dict]) -> None:
+        """Replay journal records onto the in-memory table"""
+        for record in records:
+            op = record.get("op")
+            if op == "put":
+                self._put(record["entry"], encode_entry(record["entry"]))
+            elif op == "delete":
+                self._remove(record["id"])
+            elif op == "order":
+                self._set_orders(record["orders"])
+        if records:
+            self._sorted = None
+
+    def _refresh(self) -> None:
+        """Pick up journal records written by another writer"""
+        records = self._journal.read_new()
+        if records is None:
+            self._open_journal()
+        else:
+            self._apply_records(records)
+
+    def _maybe_compact(self) -> None:
+        if self._journal.needs_compaction(len(self._headers)):
+            self._journal.compact(self._snapshot_lines())
+
+
+class SQLiteBackend(StorageBackend):
+    """Entries and metadata in a WAL-mode SQLite database.
+
+    Sorting, filtering and counting are answered from indexed columns, and
+    headers come straight from those columns. Header lists and materialized
+    entries are cached until this connection writes or PRAGMA data_version
+    reports a commit from another connection.
+    """
+
+    name = "sqlite"
+
+    _ORDER_BY = "ORDER BY (ord <= 0), ord, timestamp, id"
+
+    def __init__(self, meta_dir: Path):
+        super().__init__(meta_dir)
+        self.meta.mkdir(exist_ok=True, parents=True)
+        self.path = self.meta / SQLITE_FILE
+        self._db = sqlite3.connect(str(self.path))
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    id TEXT PRIMARY KEY,
+                    ord INTEGER NOT NULL DEFAULT 0,
+                    timestamp TEXT NOT NULL,
+                    location_type TEXT NOT NULL DEFAULT 'other',
+                    title TEXT NOT NULL DEFAULT '',
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_entries_order
+                    ON entries ((ord <= 0), ord, timestamp, id);
+                CREATE INDEX IF NOT EXISTS idx_entries_location
+                    ON entries (location_type);
+                CREATE TABLE IF NOT EXISTS session (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+            """)
+        self._headers: Optional[List[EntryHeader]] = None
+        self._cache: Dict[str, Entry] = {}
+        self._data_version = None
+
+    @classmethod
+    def detect(cls, meta_dir: Path) -> bool:
+        return (Path(meta_dir) / SQLITE_FILE).exists()
+
+    def load_metadata(self) -> Optional[dict]:
+        row = self._db.execute("SELECT value FROM session WHERE key = 'metadata'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def headers(self, location_type: Optional[str] = None) -> List[EntryHeader]:
+        if location_type is not None:
+            rows = self._db.execute(
+                "SELECT id, title, ord, timestamp, location_type FROM entries "
+                f"WHERE location_type = ? {self._ORDER_BY}",
+                (location_type,)
+            )
+            return [EntryHeader(*r) for r in rows]
+
+        self._check_version()
+        if self._headers is None:
+            rows = self._db.execute(
+                f"SELECT id, title, ord, timestamp, location_type FROM entries {self._ORDER_BY}"
+            )
+            self._headers = [EntryHeader(*r) for r in rows]
+        return list(self._headers)
+
+    def get_entry(self, entry_id: str) -> Optional[Entry]:
+        self._check_version()
+        entry = self._cache.get(entry_id)
+        if entry is None:
+            row = self._db.execute("SELECT data FROM entries WHERE id = ?", (entry_id,)).fetchone()
+            if row is not None:
+                entry = self._cache[entry_id] = Entry.from_stored(row[0])
+        return entry
+
+    def all_entries(self, location_type: Optional[str] = None) -> List[Entry]:
+        headers = self.headers(location_type)
+        missing = [h.id for h in headers if h.id not in self._cache]
+        if missing:
+            # One query for everything not yet materialized
+            rows = self._db.execute(
+                "SELECT id, data FROM entries WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(missing),)
+            )
+            for entry_id, data in rows:
+                self._cache[entry_id] = Entry.from_stored(data)
+        return [self._cache[h.id] for h in headers if h.id in self._cache]
+
+    def _check_version(self) -> None:
+        """Drop cached headers and entries if another connection committed"""
+        version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            self._headers = None
+            self._cache = {}
+            self._data_version = version
+
+    def count_by_location_type(self) -> Dict[str, int]:
+        counts = dict.fromkeys(LOCATION_TYPES, 0)
+        rows = self._db.execute("SELECT location_type, COUNT(*) FROM entries GROUP BY location_type")
+        for location_type, n in rows:
+            key = location_type if location_type in counts else "other"
+            counts[key] += n
+        return counts
+
+    def max_order(self) -> int:
+        return self._db.execute("SELECT COALESCE(MAX(ord), 0) FROM entries").fetchone()[0]
+
+    def apply(self, changes: BatchChanges) -> None:
+        """All changes in a single transaction"""
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO entries (id, ord, timestamp, location_type, title, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(e.id, e.order, e.timestamp, e.location_type, e.title, encode_entry(_dump(e)).decode("utf-8"))
+                 for e in changes.puts.values()]
+            )
+            # data is the source of truth when materializing, so keep both in step
+            self._db.executemany(
+                "UPDATE entries SET ord = ?, data = json_set(data, '$.order', ?) WHERE id = ?",
+                [(order, order, entry_id) for entry_id, order in changes.orders.items()]
+            )
+            self._db.executemany(
+                "DELETE FROM entries WHERE id = ?", [(i,) for i in changes.deletes]
+            )
+            if changes.metadata is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO session (key, value) VALUES ('metadata', ?)",
+                    (json.dumps(stamp(dict(changes.metadata))),)
+                )
+        # Our own commits don't bump data_version; update the caches directly
+        self._headers = None
+        self._cache.update(changes.puts)
+        for entry_id, order in changes.orders.items():
+            if entry_id in self._cache:
+                self._cache[entry_id].order = order
+        for entry_id in changes.deletes:
+            self._cache.pop(entry_id, None)
+
+    def compact(self) -> None:
+        self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def retire(self) -> None:
+        self.close()
+        _move_aside([self.meta / (SQLITE_FILE + suffix) for suffix in ("", "-wal", "-shm")])
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+BACKENDS = {
+    FileBackend.name: FileBackend,
+    SQLiteBackend.name: SQLiteBackend,
+}
+
+
+def open_backend(meta_dir: Path, name: Optional[str] = None) -> StorageBackend:
+    """Open the backend for a session's metadata folder.
+
+    Args:
+        meta_dir: The session's metadata/ folder
+        name: Backend to use for a new session; existing sessions always
+            open with the backend their data was written by
+
+    Returns:
+        An open StorageBackend
+    """
+    if SQLiteBackend.detect(meta_dir):
+        return SQLiteBackend(meta_dir)
+    if FileBackend.detect(meta_dir):
+        return FileBackend(meta_dir)
+    if name not in (None, DEFAULT_BACKEND):
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown storage backend: {name}")
+        # A legacy per-file session is still migrated by the file backend
+        # first, then converted below
+        if any(p.name != SESSION_FILE for p in Path(meta_dir).glob("*.json")):
+            source = FileBackend(meta_dir)
+            return _convert(source, BACKENDS[name])
+        return BACKENDS[name](meta_dir)
+    return FileBackend(meta_dir)
+
+
+def convert_session(session_root: Path, target: str) -> None:
+    """Convert a session's entries and metadata to another backend.
+
+    The previous backend's files are renamed with a .<timestamp>.bak suffix
+    once the new backend holds all data; earlier backups are never
+    overwritten. Images and templates are not touched.
+
+    Args:
+        session_root: Session folder (the one containing metadata/)
+        target: Backend name, "files" or "sqlite"
+    """
+    if target not in BACKENDS:
+        raise ValueError(f"Unknown storage backend: {target}")
+    meta_dir = Path(session_root) / "metadata"
+    source = open_backend(meta_dir)
+    if source.name == target:
+        source.close()
+        return
+    _convert(source, BACKENDS[target]).close()
+
+
+def _convert(source: StorageBackend, target_cls) -> StorageBackend:
+    """Copy everything from source into a fresh target_cls backend"""
+    metadata = source.load_metadata()
+    entries = source.all_entries()
+
+    target = target_cls(source.meta)
+    target.apply(BatchChanges(puts={e.id: e for e in entries}, metadata=metadata))
+    target.compact()
+
+    # Only move the source aside once the target holds everything
+    source.retire()
+    source.close()
+    return target
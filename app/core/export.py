@@ -0,0 +1,997 @@
+"""
+Streaming report export helpers
+
+Templates are rendered with Jinja's generate() and written chunk by chunk.
+Entry images are read, optionally recompressed and base64-encoded by a small
+thread pool a bounded number of entries ahead of the template, so peak
+memory is bounded by a few images rather than by the whole session.
+
+Templates whose per-entry markup sits in a ``{% block entry scoped %}``
+inside the entries loop are rendered incrementally: each entry's fragment is
+cached on disk and only changed or new entries are re-rendered. Fragments do
+not depend on the entry's position, so inserting, deleting or moving an
+entry re-renders only that entry.
+"""
+from pathlib import Path
+from collections import deque
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import base64
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import threading
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from jinja2 import (
+    ChoiceLoader, Environment, FileSystemBytecodeCache, FileSystemLoader,
+    FunctionLoader, TemplateNotFound, nodes
+)
+from markupsafe import Markup
+from PIL import Image
+
+from app.core.models import Entry
+
+
+# Templates shipped with DocShot; sessions get copies in <session>/_templates
+PACKAGE_TEMPLATES = Path(__file__).parent / "_templates"
+
+# Images encoded ahead of the entry the template is rendering
+EXPORT_PREFETCH = 2 * (os.cpu_count() or 1)
+EXPORT_WORKERS = min(8, os.cpu_count() or 1)
+
+# Linked-assets mode: derivatives written next to the report
+ASSETS_DIR = "assets"
+WEB_MAX_WIDTH = 1600
+THUMB_MAX_WIDTH = 480
+WEB_QUALITY = 82
+
+# Paginated export: report_pages/index.html, page-001.html, ..., toc.json
+PAGES_DIR = "report_pages"
+PAGE_SIZE = 100
+INDEX_TEMPLATE = "report_index.html.j2"
+
+# Generated child templates that splice cached fragments into a report
+SPLICE_PREFIX = "__splice__/"
+
+# Entry numbers in cached fragments: "\ue000<delta>\ue001" stands for the
+# entry's loop.index plus delta and is filled in when the fragment is spliced
+_NUMBER_MARK = "\ue000{}\ue001"
+_NUMBER_RE = re.compile("\ue000(-?\\d+)\ue001")
+
+# Shared environments, one per (template dirs, autoescape, bytecode dir)
+_environments: Dict[Tuple, Environment] = {}
+_environments_lock = threading.Lock()
+
+
+def _splice_source(name: str) -> Optional[str]:
+    """Source of the child template "__splice__/<loop var>/<template>"
+
+    It extends <template> and replaces its scoped entry block with the
+    fragment() call render_report() provides.
+    """
+    if not name.startswith(SPLICE_PREFIX):
+        return None
+    target, _, parent = name[len(SPLICE_PREFIX):].partition("/")
+    return (
+        '{% extends ' + json.dumps(parent) + ' %}'
+        '{% block entry %}{{ fragment(' + target + ', loop.index) }}{% endblock %}'
+    )
+
+
+class _BytecodeCache(FileSystemBytecodeCache):
+    """FileSystemBytecodeCache that never fails an export
+
+    Recreates a given folder if it was deleted (e.g. a cleared .cache) and
+    treats write errors as a cache miss. Without a folder it uses Jinja's
+    per-user temp folder, which Jinja creates private and checks itself.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        super().__init__(directory)
+        self.recreate = directory is not None
+
+    def dump_bytecode(self, bucket) -> None:
+        try:
+            if self.recreate:
+                Path(self.directory).mkdir(parents=True, exist_ok=True)
+            super().dump_bytecode(bucket)
+        except OSError:
+            pass
+
+
+def _load_splice(name: str):
+    """FunctionLoader hook for splice templates (their source never changes)"""
+    source = _splice_source(name)
+    if source is None:
+        return None
+    return source, None, lambda: True
+
+
+def get_environment(template_dirs: Union[Path, str, Iterable], autoescape: bool,
+                    bytecode_dir: Optional[Path] = None) -> Environment:
+    """Long-lived Jinja environment for a template directory (or search path)
+
+    Compiled templates stay in the environment between exports and are
+    re-read only when a template file's mtime changes (auto_reload). The
+    compiled bytecode is also cached on disk, keyed by template source, so
+    new processes (page workers, CLI batch exports) skip compilation too.
+
+    Args:
+        template_dirs: Template folder, or folders searched in order
+        autoescape: HTML autoescaping
+        bytecode_dir: Folder for compiled bytecode (default: Jinja's
+            private per-user folder in the system temp dir)
+    """
+    if isinstance(template_dirs, (str, Path)):
+        template_dirs = [template_dirs]
+    dirs = tuple(str(d) for d in template_dirs)
+    key = (dirs, autoescape, None if bytecode_dir is None else str(bytecode_dir))
+
+    with _environments_lock:
+        env = _environments.get(key)
+        if env is None:
+            if bytecode_dir is not None:
+                Path(bytecode_dir).mkdir(parents=True, exist_ok=True)
+                bytecode_cache = _BytecodeCache(str(bytecode_dir))
+            else:
+                try:
+                    bytecode_cache = _BytecodeCache()
+                except RuntimeError:
+                    # Jinja refuses a per-user folder it does not trust
+                    bytecode_cache = None
+            env = Environment(
+                loader=ChoiceLoader([
+                    FileSystemLoader(list(dirs)),
+                    FunctionLoader(_load_splice),
+                ]),
+                autoescape=autoescape,
+                auto_reload=True,
+                bytecode_cache=bytecode_cache,
+            )
+            _environments[key] = env
+    return env
+
+
+def encode_image(path: Path, recompress_quality: Optional[int] = None) -> Optional[Markup]:
+    """Base64 of an image file, or None if it is missing
+
+    Args:
+        path: Image file
+        recompress_quality: Re-encode as JPEG at this quality first
+            (None embeds the file as-is)
+
+    Returned as Markup: base64 needs no escaping, and skipping autoescape
+    avoids another full-size copy of the string.
+    """
+    if not path.exists():
+        return None
+    if recompress_quality is None:
+        with open(path, "rb") as f:
+            data = f.read()
+    else:
+        buf = io.BytesIO()
+        with Image.open(path) as img:
+            img.convert("RGB").save(buf, "JPEG", quality=recompress_quality, optimize=True)
+        data = buf.getvalue()
+    return Markup(base64.b64encode(data).decode("ascii"))
+
+
+def image_file(root: Path, entry: Entry) -> Path:
+    """An entry's image file; tolerates paths saved on Windows (backslashes)"""
+    return Path(root) / entry.image.path.replace("\\", "/")
+
+
+def _scaled_width(width: int, max_width: int) -> int:
+    return min(width, max_width) if width > 0 else max_width
+
+
+def _make_derivatives(src: str, web: str, thumb: str, quality: int) -> None:
+    """Write the web copy and thumbnail of one screenshot (process pool worker)"""
+    with Image.open(src) as img:
+        img = img.convert("RGB")
+        for path, max_width in ((web, WEB_MAX_WIDTH), (thumb, THUMB_MAX_WIDTH)):
+            copy = img
+            if img.width > max_width:
+                height = max(1, round(img.height * max_width / img.width))
+                copy = img.resize((max_width, height), Image.LANCZOS)
+            tmp = path + ".tmp"
+            copy.save(tmp, "JPEG", quality=quality, optimize=True, progressive=True)
+            os.replace(tmp, path)
+
+
+def asset_paths(entry: Entry, prefix: str = "") -> Dict[str, str]:
+    """Report-relative paths and widths of an entry's linked assets
+
+    Args:
+        entry: Entry
+        prefix: Path from the report's folder to the session folder
+            ("" for reports in the session folder, "../" for pages)
+    """
+    full = entry.image.path.replace("\\", "/")
+    stem = Path(full).stem
+    return {
+        "full": prefix + full,
+        "web": f"{prefix}{ASSETS_DIR}/{stem}_web.jpg",
+        "thumb": f"{prefix}{ASSETS_DIR}/{stem}_thumb.jpg",
+        "web_width": _scaled_width(entry.image.width, WEB_MAX_WIDTH),
+        "thumb_width": _scaled_width(entry.image.width, THUMB_MAX_WIDTH),
+    }
+
+
+def build_assets(root: Path, entries: List[Entry], quality: int = WEB_QUALITY,
+                 workers: int = EXPORT_WORKERS) -> None:
+    """Generate web copies and thumbnails for linked-assets export
+
+    Runs in a process pool (resizing and JPEG encoding are CPU bound).
+    Derivatives newer than their source image are kept, so re-exports
+    only process new or changed screenshots. Derivatives of entries that
+    no longer exist are removed.
+    """
+    root = Path(root)
+    assets = root / ASSETS_DIR
+    assets.mkdir(exist_ok=True)
+
+    jobs = []
+    keep = set()
+    for entry in entries:
+        src = image_file(root, entry)
+        paths = asset_paths(entry)
+        web, thumb = root / paths["web"], root / paths["thumb"]
+        keep.update((web.name, thumb.name))
+        if not src.exists():
+            continue
+        src_mtime = src.stat().st_mtime_ns
+        if all(p.exists() and p.stat().st_mtime_ns >= src_mtime for p in (web, thumb)):
+            continue
+        jobs.append((str(src), str(web), str(thumb), quality))
+
+    if len(jobs) == 1 or workers <= 1:
+        for job in jobs:
+            _make_derivatives(*job)
+    elif jobs:
+        # spawn, not fork: forking a process with Qt and worker threads
+        # running can deadlock the children
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            for future in [pool.submit(_make_derivatives, *job) for job in jobs]:
+                future.result()
+
+    for path in assets.iterdir():
+        if path.name not in keep:
+            path.unlink()
+
+
+class EmbeddedImageEntries:
+    """Entry dicts for report templates, each with its image_base64
+
+    Behaves like a list for templates ({% for %}, |length) but builds entry
+    dicts as the template consumes them. With prefetch > 0, a thread pool
+    encodes up to that many images ahead of the template, in entry order;
+    an entry's image is released as soon as the template moves on.
+    """
+
+    def __init__(self, root: Path, entries: List[Entry], prefetch: int = EXPORT_PREFETCH,
+                 workers: int = EXPORT_WORKERS, recompress_quality: Optional[int] = None,
+                 embed_images: bool = True, skip_image: Optional[Callable[[int], bool]] = None,
+                 linked_assets: bool = False, link_prefix: str = ""):
+        """
+        Args:
+            root: Session folder image paths are relative to
+            entries: Entries in report order
+            prefetch: Images to encode ahead (0 = encode inline, one at a time)
+            workers: Threads reading and encoding images
+            recompress_quality: Re-encode images as JPEG at this quality
+            embed_images: False yields plain entry dicts without image_base64
+            skip_image: Called with an entry's 0-based position; True leaves
+                its image_base64 as None (its fragment is already cached)
+            linked_assets: Yield entry.assets (see asset_paths()) instead
+                of embedding images
+            link_prefix: Prefix for linked asset paths (see asset_paths())
+        """
+        self.root = Path(root)
+        self._entries = entries
+        self.prefetch = prefetch
+        self.workers = workers
+        self.recompress_quality = recompress_quality
+        self.embed_images = embed_images
+        self.skip_image = skip_image
+        self.linked_assets = linked_assets
+        self.link_prefix = link_prefix
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _encode(self, entry: Entry) -> Optional[Markup]:
+        return encode_image(image_file(self.root, entry), self.recompress_quality)
+
+    def __iter__(self) -> Iterator[dict]:
+        if self.linked_assets:
+            for entry in self._entries:
+                entry_dict = entry.model_dump()
+                entry_dict["image_base64"] = None
+                entry_dict["assets"] = asset_paths(entry, self.link_prefix)
+                yield entry_dict
+            return
+
+        if not self.embed_images:
+            for entry in self._entries:
+                yield entry.model_dump()
+            return
+
+        if self.skip_image is not None:
+            # Placeholder entries for cached fragments; nothing to encode
+            todo = [e for i, e in enumerate(self._entries) if not self.skip_image(i)]
+            encoded = iter(EmbeddedImageEntries(
+                self.root, todo, self.prefetch, self.workers, self.recompress_quality
+            ))
+            for i, entry in enumerate(self._entries):
+                if self.skip_image(i):
+                    entry_dict = entry.model_dump()
+                    entry_dict["image_base64"] = None
+                    yield entry_dict
+                else:
+                    yield next(encoded)
+            return
+
+        if self.prefetch <= 0 or len(self._entries) < 2:
+            for entry in self._entries:
+                entry_dict = entry.model_dump()
+                entry_dict["image_base64"] = self._encode(entry)
+                yield entry_dict
+            return
+
+        pool = ThreadPoolExecutor(max_workers=max(1, self.workers),
+                                  thread_name_prefix="docshot-export")
+        pending = deque()
+        entries = iter(self._entries)
+        try:
+            # Keep up to prefetch images in flight; FIFO keeps output order
+            for entry in entries:
+                pending.append((entry, pool.submit(self._encode, entry)))
+                if len(pending) >= self.prefetch:
+                    break
+            while pending:
+                entry, future = pending.popleft()
+                for next_entry in entries:
+                    pending.append((next_entry, pool.submit(self._encode, next_entry)))
+                    break
+                entry_dict = entry.model_dump()
+                entry_dict["image_base64"] = future.result()
+                yield entry_dict
+        finally:
+            # Template error or abandoned iteration: drop queued work
+            for _, future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+
+def _file_identity(path: Path) -> Optional[list]:
+    """[mtime_ns, size] of a file, or None if missing"""
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def entry_block_target(env, name: str) -> Optional[str]:
+    """Loop variable of a template's scoped ``entry`` block, if it has one
+
+    Incremental export needs the per-entry markup in
+    ``{% block entry scoped %}`` directly inside ``{% for x in entries %}``
+    (plain entries: no filter, no ``if``), and the block may use only
+    loop.index and loop.index0 of the loop and must not read entries;
+    returns "x", or None for other templates (they are rendered in full).
+    """
+    block = _entry_block(env, env.loader.get_source(env, name)[0])
+    return block[0] if block else None
+
+
+# Loop attributes a cached fragment can provide (see _FragmentLoop)
+_FRAGMENT_LOOP_ATTRS = ("index", "index0")
+
+
+@lru_cache(maxsize=64)
+def _entry_block(env, source: str) -> Optional[Tuple[str, FrozenSet[str], FrozenSet[str]]]:
+    """(loop variable, names read, attributes read) of the scoped entry block
+
+    None if the template has no such block or the block cannot be cached
+    per entry (see entry_block_target()).
+    """
+    for loop in env.parse(source).find_all(nodes.For):
+        if not isinstance(loop.target, nodes.Name):
+            continue
+        for block in loop.find_all(nodes.Block):
+            if block.name == "entry" and block.scoped:
+                # Fragments are matched to entries by id but numbered by
+                # loop.index, which is the entry's position only for a
+                # plain loop over entries
+                plain = (isinstance(loop.iter, nodes.Name) and loop.iter.name == "entries"
+                         and loop.test is None and not loop.recursive)
+                names = frozenset(n.name for n in block.find_all(nodes.Name) if n.ctx == "load")
+                attrs = frozenset(a.attr for a in block.find_all(nodes.Getattr))
+                # Every use of loop must be loop.index or loop.index0
+                loop_uses = sum(1 for n in block.find_all(nodes.Name) if n.name == "loop")
+                index_uses = sum(1 for a in block.find_all(nodes.Getattr)
+                                 if isinstance(a.node, nodes.Name) and a.node.name == "loop"
+                                 and a.attr in _FRAGMENT_LOOP_ATTRS)
+                if not plain or "entries" in names or loop_uses != index_uses:
+                    return None
+                return loop.target.name, names, attrs
+    return None
+
+
+def template_references(env, name: str) -> FrozenSet[str]:
+    """Variable and attribute names a template reads
+
+    Session templates are copies that are never updated, so exports use this
+    to check that a copy knows about a feature (e.g. "assets" for linked
+    assets) before relying on it.
+    """
+    return _references(env, env.loader.get_source(env, name)[0])
+
+
+@lru_cache(maxsize=64)
+def _references(env, source: str) -> FrozenSet[str]:
+    ast = env.parse(source)
+    return (frozenset(n.name for n in ast.find_all(nodes.Name) if n.ctx == "load")
+            | frozenset(a.attr for a in ast.find_all(nodes.Getattr)))
+
+
+class _Position(int):
+    """loop.index (or loop.index0) while a fragment is rendered for the cache
+
+    Prints as a marker that fill_numbers() replaces with the entry's actual
+    number, so a cached fragment fits the entry at any position. Adding or
+    subtracting integers (``loop.index + entry_offset``) shifts the marker;
+    anything else (comparisons, other arithmetic) sees a meaningless int.
+    """
+
+    def __new__(cls, delta: int = 0):
+        position = super().__new__(cls, delta)
+        position.delta = delta
+        return position
+
+    def __add__(self, other):
+        if isinstance(other, int) and not isinstance(other, bool):
+            return _Position(self.delta + other)
+        return NotImplemented
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, int) and not isinstance(other, bool):
+            return _Position(self.delta - other)
+        return NotImplemented
+
+    def __str__(self):
+        return _NUMBER_MARK.format(self.delta)
+
+    def __html__(self):
+        return str(self)
+
+
+def fill_numbers(text: str, index: int) -> str:
+    """A cached fragment with its position markers set for loop.index == index"""
+    if "\ue000" not in text:
+        return text
+    return _NUMBER_RE.sub(lambda m: str(index + int(m.group(1))), text)
+
+
+class _FragmentLoop:
+    """Stand-in for Jinja's loop object when rendering a single fragment
+
+    Only index and index0 are available, as _Position markers; a fragment
+    must not depend on its position or on the other entries.
+    """
+
+    def __init__(self):
+        self.index = _Position(0)
+        self.index0 = _Position(-1)
+
+
+class FragmentCache:
+    """Rendered per-entry fragments of one template, cached on disk
+
+    A fragment is keyed by the entry's JSON, its image file's identity and
+    the template version (source, options and the template variables the
+    entry block reads), so any change to those re-renders just that entry.
+    The position is not part of the key: entry numbers are markers filled
+    in by fill_numbers(). Entry.order is left out unless the block shows it,
+    so respacing order keys re-renders nothing.
+
+    Fragments of reports with embedded images hold the base64 image, so the
+    cache takes about as much disk space as the report itself (prune() keeps
+    it to the current entries).
+    """
+
+    def __init__(self, cache_dir: Path, template_version: str, uses_order: bool = False):
+        self.dir = Path(cache_dir)
+        self.version = template_version
+        self.exclude = None if uses_order else {"order"}
+        self.manifest_path = self.dir / "manifest.json"
+
+    def key(self, entry: Entry, image_path: Path) -> str:
+        h = hashlib.sha256()
+        h.update(self.version.encode("utf-8"))
+        h.update(entry.model_dump_json(exclude=self.exclude).encode("utf-8"))
+        h.update(json.dumps([str(entry.image.path), _file_identity(image_path)]).encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        path = self.dir / key
+        if not path.exists():
+            return None
+        return path.read_text(encoding="utf-8")
+
+    def __contains__(self, key: str) -> bool:
+        return (self.dir / key).exists()
+
+    def put(self, key: str, text: str) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.dir / (key + ".tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, self.dir / key)
+
+    def prune(self, keep: Set[str]) -> None:
+        """Delete fragments no longer referenced by the report"""
+        if not self.dir.exists():
+            return
+        for path in self.dir.iterdir():
+            if path != self.manifest_path and path.name not in keep:
+                path.unlink()
+
+    def load_manifest(self) -> dict:
+        try:
+            return json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def save_manifest(self, manifest: dict) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_path.write_text(json.dumps(manifest), encoding="utf-8")
+
+
+class ReportJob:
+    """One report template rendered to one output file
+
+    Works out up front which entries have a cached fragment and whether the
+    whole output is already up to date; generate() then yields the rendered
+    text for a stream of entry dicts, splicing in cached fragments.
+    """
+
+    def __init__(self, env, name: str, out: Path, entries: List[Entry], root: Path,
+                 cache_dir: Optional[Path] = None, embed_images: bool = False,
+                 recompress_quality: Optional[int] = None, linked_assets: bool = False,
+                 link_prefix: str = "", entry_offset: int = 0, **context):
+        """
+        Args:
+            env: Jinja Environment holding the template
+            name: Template name
+            out: Output file
+            entries: Entries in report order
+            root: Session folder (image paths are relative to it)
+            cache_dir: Folder for this template's fragment cache (None = no cache)
+            embed_images: The template shows entry.image_base64
+            recompress_quality: Re-encode embedded images at this JPEG quality
+            linked_assets: Reference web copies and thumbnails in assets/
+                instead of embedding images; build_assets() must have run
+            link_prefix: Path from the output's folder to the session folder
+            entry_offset: Number of entries before these ones (for pages);
+                available to the template as entry_offset
+            context: Other template variables; export_date does not count as
+                a change on its own
+        """
+        self.env = env
+        self.name = name
+        self.out = Path(out)
+        self.embed_images = embed_images and not linked_assets
+        self.context = dict(context, entry_offset=entry_offset)
+        self.tpl = env.get_template(name)
+        self.target = None
+        self.up_to_date = False
+        self.cache = None
+        self.ids = [e.id for e in entries]
+        self.keys: List[str] = []
+        self.cached: List[bool] = []
+        if cache_dir is None:
+            return
+        source = env.loader.get_source(env, name)[0]
+        block = _entry_block(env, source)
+        if block is None:
+            return
+        self.target, names, attrs = block
+
+        # Template variables the entry block reads go into every fragment
+        # (export_date does not, or each export would expire them all)
+        digest_input = {k: v for k, v in self.context.items() if k != "export_date"}
+        block_context = {k: v for k, v in digest_input.items() if k in names}
+        root = Path(root)
+        version = hashlib.sha256(
+            json.dumps([source, self.embed_images, recompress_quality, linked_assets, link_prefix,
+                        block_context], sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+        self.cache = FragmentCache(Path(cache_dir), version, uses_order="order" in attrs)
+        self.keys = [self.cache.key(e, image_file(root, e)) for e in entries]
+
+        # Nothing changed since the last export: keep the existing file
+        self.digest = hashlib.sha256(
+            json.dumps([version, self.keys, digest_input], sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+        manifest = self.cache.load_manifest()
+        self.up_to_date = (manifest.get("digest") == self.digest
+                           and manifest.get("output") == _file_identity(self.out))
+        if not self.up_to_date:
+            self.cached = [key in self.cache for key in self.keys]
+
+    def needs_image(self, position: int) -> bool:
+        """True if the entry at a 0-based position will be rendered with its image"""
+        return self.embed_images and not (self.cached and self.cached[position])
+
+    def generate(self, rows) -> Iterator[str]:
+        """Rendered chunks of the report for a sequence of entry dicts"""
+        if self.target is None:
+            return self.tpl.generate(entries=rows, **self.context)
+
+        tpl, cache, target = self.tpl, self.cache, self.target
+        context = self.context
+        # Fragments are looked up by entry id, never by loop position
+        keys = dict(zip(self.ids, self.keys))
+        cached = dict(zip(self.ids, self.cached))
+
+        def fragment(entry: dict, index: int) -> Markup:
+            entry_id = entry["id"]
+            key = keys[entry_id]
+            text = cache.get(key) if cached.get(entry_id) else None
+            if text is None:
+                ctx = tpl.new_context(dict(context, **{target: entry, "loop": _FragmentLoop()}))
+                text = "".join(tpl.blocks["entry"](ctx))
+                cache.put(key, text)
+            return Markup(fill_numbers(text, index))
+
+        # Child template that splices fragments in place of the entry block
+        # (compiled once per shared environment, see get_environment())
+        child_name = f"{SPLICE_PREFIX}{target}/{self.name}"
+        try:
+            child = self.env.get_template(child_name)
+        except TemplateNotFound:
+            child = self.env.from_string(_splice_source(child_name))
+        return child.generate(entries=rows, fragment=fragment, **context)
+
+    def finish(self) -> None:
+        """Record a successful render so an unchanged re-export is skipped"""
+        if self.cache is None:
+            return
+        self.cache.prune(set(self.keys))
+        self.cache.save_manifest({"digest": self.digest, "output": _file_identity(self.out)})
+
+
+def render_report(env, name: str, out: Path, entries: List[Entry], root: Path,
+                  cache_dir: Optional[Path] = None, embed_images: bool = False,
+                  recompress_quality: Optional[int] = None, linked_assets: bool = False,
+                  link_prefix: str = "", entry_offset: int = 0, **context) -> Path:
+    """Render a report template for a list of entries to a file
+
+    If the template has a scoped ``entry`` block and cache_dir is given,
+    cached fragments are spliced in for unchanged entries and only changed
+    or new entries are rendered (and have their images encoded). When no
+    input changed since the last export and the output file is untouched,
+    the file is left as it is. Arguments are as for ReportJob.
+
+    Returns:
+        The output path
+    """
+    job = ReportJob(env, name, out, entries, root, cache_dir=cache_dir,
+                    embed_images=embed_images, recompress_quality=recompress_quality,
+                    linked_assets=linked_assets, link_prefix=link_prefix,
+                    entry_offset=entry_offset, **context)
+    if not job.up_to_date:
+        rows = EmbeddedImageEntries(root, entries, recompress_quality=recompress_quality,
+                                    embed_images=job.embed_images, skip_image=lambda i: not job.needs_image(i),
+                                    linked_assets=linked_assets, link_prefix=link_prefix)
+        _write_outputs([(job.generate(rows), job.out)])
+        job.finish()
+    return job.out
+
+
+@dataclass
+class ExportFormat:
+    """A report format SessionStore.export() can produce"""
+    template: str  # Template name in the session's _templates folder
+    output: str  # Output file name in the session folder
+    autoescape: bool = False
+    images: bool = False  # Shows images (embedded as base64 or linked assets)
+
+
+# Formats by name; register new ones with register_format()
+EXPORT_FORMATS: Dict[str, ExportFormat] = {}
+
+
+def register_format(name: str, fmt: ExportFormat) -> None:
+    """Make a report format available to SessionStore.export()"""
+    EXPORT_FORMATS[name] = fmt
+
+
+register_format("md", ExportFormat("report.md.j2", "report.md"))
+register_format("html", ExportFormat("report.html.j2", "report.html", autoescape=True, images=True))
+
+
+class _SharedRows:
+    """Entry dicts produced once and read by several templates at once
+
+    Each template gets its own reader (list-like: len() and iteration).
+    Rows are buffered only until every reader has moved past them; a
+    template that starts over gets earlier rows rebuilt on demand.
+    """
+
+    def __init__(self, source: Iterable[dict], rebuild: Callable[[int], dict], length: int):
+        self._source = iter(source)
+        self._rebuild = rebuild
+        self._length = length
+        self._buffer = deque()
+        self._base = 0  # Position of _buffer[0]
+        self.readers: List["_RowReader"] = []
+
+    def reader(self) -> "_RowReader":
+        reader = _RowReader(self)
+        self.readers.append(reader)
+        return reader
+
+    def __len__(self):
+        return self._length
+
+    def _get(self, position: int) -> dict:
+        if position < self._base:
+            return self._rebuild(position)
+        while position >= self._base + len(self._buffer):
+            self._buffer.append(next(self._source))
+        row = self._buffer[position - self._base]
+        # Drop rows every reader is done with
+        low = min(r.position for r in self.readers)
+        while self._buffer and self._base < low:
+            self._buffer.popleft()
+            self._base += 1
+        return row
+
+
+class _RowReader:
+    """One template's view of _SharedRows"""
+
+    def __init__(self, shared: _SharedRows):
+        self._shared = shared
+        self.position = 0  # Row the template is on (rows before it are done)
+
+    def __len__(self):
+        return len(self._shared)
+
+    def __iter__(self) -> Iterator[dict]:
+        for position in range(len(self._shared)):
+            self.position = position
+            yield self._shared._get(position)
+        self.position = len(self._shared)
+
+
+def render_formats(jobs: List[ReportJob], entries: List[Entry], root: Path,
+                   recompress_quality: Optional[int] = None, linked_assets: bool = False,
+                   link_prefix: str = "") -> None:
+    """Render several reports in one pass over the entries
+
+    Each entry is dumped once and each image read and encoded once (only if
+    some job still needs it), then handed to every template. The templates
+    are advanced in lockstep, one entry at a time, so only about two entry
+    rows are held in memory regardless of the number of formats.
+    """
+    jobs = [job for job in jobs if not job.up_to_date]
+    if not jobs:
+        return
+
+    embed = any(job.embed_images for job in jobs)
+
+    def skip(position: int) -> bool:
+        return not any(job.needs_image(position) for job in jobs)
+
+    rows = EmbeddedImageEntries(root, entries, recompress_quality=recompress_quality,
+                                embed_images=embed, skip_image=skip,
+                                linked_assets=linked_assets, link_prefix=link_prefix)
+
+    def rebuild(position: int) -> dict:
+        single = EmbeddedImageEntries(root, entries[position:position + 1], prefetch=0,
+                                      recompress_quality=recompress_quality, embed_images=embed,
+                                      linked_assets=linked_assets, link_prefix=link_prefix)
+        return next(iter(single))
+
+    shared = _SharedRows(rows, rebuild, len(entries))
+    _write_outputs([(job.generate(shared.reader()), job.out) for job in jobs], shared.readers)
+    for job in jobs:
+        job.finish()
+
+
+def _write_outputs(outputs, readers=None) -> None:
+    """Write several chunk streams to their files, interleaved entry by entry
+
+    Each output goes to a temp file; all of them replace their targets only
+    once every stream has finished, so a failure leaves the old files.
+
+    Args:
+        outputs: (chunk iterator, output path) pairs
+        readers: _RowReader of each output, to advance them in lockstep
+    """
+    tmps = [Path(out).with_name(Path(out).name + ".tmp") for _, out in outputs]
+    files = [open(tmp, "w", encoding="utf-8") for tmp in tmps]
+    try:
+        active = list(range(len(outputs)))
+        frontier = 0
+        while active:
+            for k in list(active):
+                chunks, f = outputs[k][0], files[k]
+                for chunk in chunks:
+                    f.write(chunk)
+                    if readers is not None and readers[k].position > frontier:
+                        break  # Let the other templates catch up
+                else:
+                    active.remove(k)
+            frontier += 1
+        for f in files:
+            f.close()
+        for tmp, (_, out) in zip(tmps, outputs):
+            os.replace(tmp, out)
+    finally:
+        for f in files:
+            f.close()
+        for tmp in tmps:
+            if tmp.exists():
+                tmp.unlink()
+
+
+def page_file(number: int) -> str:
+    return f"page-{number:03d}.html"
+
+
+def build_toc(entries: List[Entry], page_size: int, **info) -> dict:
+    """Table of contents for a paginated report (also written as toc.json)
+
+    Args:
+        entries: Entries in report order
+        page_size: Entries per page
+        info: Extra top-level fields (report_title, export_date, ...)
+    """
+    pages = []
+    for start in range(0, len(entries), page_size):
+        number = len(pages) + 1
+        chunk = entries[start:start + page_size]
+        pages.append({
+            "number": number,
+            "file": page_file(number),
+            "first_entry": start + 1,
+            "last_entry": start + len(chunk),
+            "entries": [
+                {
+                    "number": start + i,
+                    "id": e.id,
+                    "title": e.title,
+                    "timestamp": e.timestamp,
+                    "location_type": e.location_type,
+                    "href": f"{page_file(number)}#entry-{e.id}",
+                }
+                for i, e in enumerate(chunk, 1)
+            ],
+        })
+    return dict(info, total_entries=len(entries), page_size=page_size, pages=pages)
+
+
+def _render_page(template_dirs: List[str], bytecode_dir: Optional[str], name: str, out: str,
+                 entries: List[Entry], root: str, cache_dir: str, options: dict,
+                 context: dict) -> str:
+    """Render one report page (process pool worker)"""
+    env = get_environment(template_dirs, autoescape=True, bytecode_dir=bytecode_dir)
+    return str(render_report(env, name, Path(out), entries, Path(root),
+                             cache_dir=Path(cache_dir), **options, **context))
+
+
+def render_pages(template_dirs: List[Path], name: str, out_dir: Path, entries: List[Entry],
+                 root: Path, cache_dir: Path, page_size: int = PAGE_SIZE,
+                 workers: int = EXPORT_WORKERS, embed_images: bool = True,
+                 recompress_quality: Optional[int] = None, linked_assets: bool = False,
+                 bytecode_dir: Optional[Path] = None, **context) -> Path:
+    """Render a session as pages of page_size entries plus an index page
+
+    Writes out_dir/page-NNN.html (each rendered by render_report with its own
+    fragment cache, in a process pool), out_dir/toc.json and
+    out_dir/index.html. Every page holds at most page_size entries, so page
+    size and render memory do not grow with the session.
+
+    Args:
+        template_dirs: Template folders, searched in order (session first)
+        name: Page template name
+        out_dir: Output folder
+        entries: Entries in report order
+        root: Session folder
+        cache_dir: Folder for the per-page fragment caches
+        page_size: Entries per page
+        workers: Pages rendered in parallel
+        embed_images, recompress_quality, linked_assets: As for render_report
+        bytecode_dir: Compiled template cache (see get_environment())
+        context: Other template variables, also passed to the index page
+
+    Returns:
+        Path of index.html
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cache_dir = Path(cache_dir)
+    page_size = max(1, page_size)
+    dirs = [str(d) for d in template_dirs]
+    bytecode_dir = str(bytecode_dir) if bytecode_dir is not None else None
+
+    toc = build_toc(entries, page_size, **{k: v for k, v in context.items()
+                                           if isinstance(v, (str, int, float))})
+    count = len(toc["pages"])
+    options = dict(embed_images=embed_images, recompress_quality=recompress_quality,
+                   linked_assets=linked_assets, link_prefix="../")
+    jobs = []
+    for page in toc["pages"]:
+        number = page["number"]
+        page_context = dict(
+            context,
+            entry_offset=page["first_entry"] - 1,
+            total_entries=len(entries),
+            page={
+                "number": number,
+                "count": count,
+                "first_entry": page["first_entry"],
+                "last_entry": page["last_entry"],
+                "prev": page_file(number - 1) if number > 1 else None,
+                "next": page_file(number + 1) if number < count else None,
+                "index": "index.html",
+            },
+        )
+        jobs.append((dirs, bytecode_dir, name, str(out_dir / page["file"]),
+                     entries[page["first_entry"] - 1:page["last_entry"]],
+                     str(root), str(cache_dir / Path(page["file"]).stem),
+                     options, page_context))
+
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            _render_page(*job)
+    else:
+        # spawn, as in build_assets()
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            for future in [pool.submit(_render_page, *job) for job in jobs]:
+                future.result()
+
+    # Drop pages (and their caches) left over from a larger export
+    keep = {page["file"] for page in toc["pages"]}
+    for path in out_dir.glob("page-*.html"):
+        if path.name not in keep:
+            path.unlink()
+    if cache_dir.exists():
+        for path in cache_dir.iterdir():
+            if path.is_dir() and path.name + ".html" not in keep:
+                shutil.rmtree(path)
+
+    toc_path = out_dir / "toc.json"
+    tmp = toc_path.with_name(toc_path.name + ".tmp")
+    tmp.write_text(json.dumps(toc, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp, toc_path)
+
+    env = get_environment(dirs, autoescape=True, bytecode_dir=bytecode_dir)
+    return stream_template(env.get_template(INDEX_TEMPLATE), out_dir / "index.html",
+                           toc=toc, **context)
+
+
+def stream_template(tpl, out: Path, **context) -> Path:
+    """Render a template straight to a file
+
+    Chunks from tpl.generate() go to a temp file that replaces out once
+    complete, so a failed export never leaves a truncated report behind.
+    """
+    out = Path(out)
+    _write_outputs([(tpl.generate(**context), out)])
+    return out
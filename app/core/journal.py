@@ -0,0 +1,169 @@
+"""
+Append-only entry journal for session metadata
+
+Every entry mutation (put, delete, reorder) is appended as one JSON line to
+``entries.jsonl``. Opening a session replays ``entries.snapshot.jsonl`` and
+then the journal, both as single sequential reads. Compaction rewrites the
+snapshot from the live entry table and truncates the journal.
+"""
+from pathlib import Path
+import json
+import os
+from typing import Iterable, List, Optional, Tuple, Union
+
+JOURNAL_NAME = "entries.jsonl"
+SNAPSHOT_NAME = "entries.snapshot.jsonl"
+
+# Compact once the journal holds this many records more than there are
+# live entries (it is mostly superseded puts at that point)
+COMPACT_MIN_RECORDS = 500
+
+
+def encode_entry(data: dict) -> bytes:
+    """Compact JSON encoding used for snapshot lines"""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _signature(path: Path) -> Optional[Tuple[int, int]]:
+    """(mtime_ns, size) of a file, or None if it does not exist"""
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _split_lines(data: bytes) -> List[bytes]:
+    """Non-empty, newline-terminated lines of a snapshot file"""
+    end = data.rfind(b"\n") + 1
+    return [line for line in data[:end].split(b"\n") if line.strip()]
+
+
+def _parse_lines(data: bytes) -> Tuple[List[dict], int]:
+    """Parse complete JSON lines from a chunk of journal bytes.
+
+    A trailing line without a newline (an interrupted append) is left
+    unconsumed so a later read can pick it up once it is complete.
+
+    Returns:
+        (records, number of bytes consumed)
+    """
+    end = data.rfind(b"\n") + 1
+    records = []
+    for line in data[:end].splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            # Torn write from a crash - skip the damaged record
+            continue
+    return records, end
+
+
+class EntryJournal:
+    """Snapshot + append-only journal pair inside a session's metadata folder.
+
+    Single writer per session: the journal only tracks its own read offset,
+    so records appended by another process are picked up by read_new().
+    """
+
+    def __init__(self, directory: Path):
+        self.dir = Path(directory)
+        self.path = self.dir / JOURNAL_NAME
+        self.snapshot_path = self.dir / SNAPSHOT_NAME
+        self.records_since_compaction = 0
+        self._offset = 0
+        self._snapshot_sig: Optional[Tuple[int, int]] = None
+
+    def exists(self) -> bool:
+        """True if this session already uses the journal format"""
+        return self.path.exists() or self.snapshot_path.exists()
+
+    def load(self) -> Tuple[List[bytes], List[dict]]:
+        """Read the snapshot and the whole journal.
+
+        Returns:
+            (snapshot lines, one compact JSON entry each, still undecoded;
+            journal records to replay on top)
+        """
+        self._snapshot_sig = _signature(self.snapshot_path)
+        snapshot: List[bytes] = []
+        if self._snapshot_sig is not None:
+            snapshot = _split_lines(self.snapshot_path.read_bytes())
+
+        records: List[dict] = []
+        self._offset = 0
+        if self.path.exists():
+            records, self._offset = _parse_lines(self.path.read_bytes())
+        self.records_since_compaction = len(records)
+        return snapshot, records
+
+    def read_new(self) -> Optional[List[dict]]:
+        """Records appended since the last load()/read_new().
+
+        Returns:
+            New records, or None if the files were replaced (e.g. compacted
+            by another process) and a full load() is needed.
+        """
+        if _signature(self.snapshot_path) != self._snapshot_sig:
+            return None
+        sig = _signature(self.path)
+        size = sig[1] if sig else 0
+        if size < self._offset:
+            return None
+        if size == self._offset:
+            return []
+
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            records, consumed = _parse_lines(f.read())
+        self._offset += consumed
+        self.records_since_compaction += len(records)
+        return records
+
+    def append(self, records: List[dict]) -> None:
+        """Durably append records with a single write and fsync"""
+        if not records:
+            return
+        self.dir.mkdir(exist_ok=True, parents=True)
+        payload = "".join(
+            json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in records
+        ).encode("utf-8")
+        with open(self.path, "ab") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        self._offset += len(payload)
+        self.records_since_compaction += len(records)
+
+    def needs_compaction(self, live_entries: int) -> bool:
+        """True once superseded records dominate the journal"""
+        return self.records_since_compaction > max(COMPACT_MIN_RECORDS, live_entries)
+
+    def compact(self, entries: Iterable[Union[dict, bytes]]) -> None:
+        """Write a fresh snapshot of the live entries and truncate the journal.
+
+        Entries may be dicts or already-encoded compact JSON lines.
+
+        The snapshot is written to a temp file and renamed into place before
+        the journal is truncated; replaying the old journal over the new
+        snapshot after a crash is harmless because every record is idempotent.
+        """
+        self.dir.mkdir(exist_ok=True, parents=True)
+        tmp = self.snapshot_path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            for data in entries:
+                f.write(data if isinstance(data, bytes) else encode_entry(data))
+                f.write(b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+
+        with open(self.path, "wb") as f:
+            os.fsync(f.fileno())
+
+        self._snapshot_sig = _signature(self.snapshot_path)
+        self._offset = 0
+        self.records_since_compaction = 0
@@ -1,8 +1,27 @@
 
 from pydantic import BaseModel
 from datetime import datetime, timezone
+import json
 import uuid
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Union
+
+# Stamped as "v" into every entry and session record DocShot writes, as the
+# last key of the compact JSON. Records at this version take the fast decode
+# path in Entry.from_stored(); anything else is parsed and validated as before.
+SCHEMA_VERSION = 1
+_STAMP = f',"v":{SCHEMA_VERSION}}}'
+_STAMP_BYTES = _STAMP.encode("ascii")
+
+def stamp(data: dict) -> dict:
+    """Add the current schema version to a dumped model (in place)"""
+    data.pop("v", None)
+    data["v"] = SCHEMA_VERSION
+    return data
+
+def is_current(raw: Union[bytes, str]) -> bool:
+    """True if a compact JSON record carries the current schema stamp"""
+    raw = raw.rstrip()
+    return raw.endswith(_STAMP_BYTES if isinstance(raw, bytes) else _STAMP)
 
 class ImageModel(BaseModel):
     path: str
@@ -31,6 +50,18 @@ class Entry(BaseModel):
     
     context: Dict = {}
 
+    @classmethod
+    def from_stored(cls, raw: Union[bytes, str]) -> "Entry":
+        """Build an Entry from a stored compact JSON record
+        
+        Records DocShot wrote at the current SCHEMA_VERSION are decoded in
+        one pass by pydantic-core straight from the bytes. Older or foreign
+        records go through json.loads and the regular constructor.
+        """
+        if is_current(raw):
+            return cls.model_validate_json(raw)
+        return cls(**json.loads(raw))
+
     @classmethod
     def new(cls, title: str, layout: str, image: ImageModel,
             details: str = "", location_type: str = "other", 
@@ -48,6 +79,40 @@ class Entry(BaseModel):
             notes=notes,
         )
 
+class EntryHeader:
+    """Lightweight projection of an Entry for list views, stats and filters
+    
+    Holds only the fields those views need, in slots, so a large session can
+    be listed without building a full pydantic Entry per row.
+    """
+    __slots__ = ("id", "title", "order", "timestamp", "location_type")
+    
+    def __init__(self, id: str, title: str, order: int, timestamp: str,
+                 location_type: str = "other"):
+        self.id = id
+        self.title = title
+        self.order = order
+        self.timestamp = timestamp
+        self.location_type = location_type
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> "EntryHeader":
+        """Build from a raw entry dict (as stored on disk)"""
+        return cls(
+            data["id"],
+            data.get("title", ""),
+            data.get("order", 0),
+            data.get("timestamp", ""),
+            data.get("location_type", "other"),
+        )
+    
+    @classmethod
+    def from_entry(cls, entry: Entry) -> "EntryHeader":
+        return cls(entry.id, entry.title, entry.order, entry.timestamp, entry.location_type)
+    
+    def __repr__(self):
+        return f"EntryHeader(id={self.id!r}, title={self.title!r}, order={self.order})"
+
 class SessionMetadata(BaseModel):
     """V3.5: Session-level metadata"""
     report_title: str = "Overlay Annotator Report"  # Editable report name
@@ -55,6 +120,7 @@ class SessionMetadata(BaseModel):
     created: str = ""
     last_modified: str = ""
     entry_count: int = 0
+    max_order: int = 0  # Highest Entry.order assigned so far (next = max_order + gap)
     
     @classmethod
     def new(cls, report_title: str = "Overlay Annotator Report"):
@@ -0,0 +1,64 @@
+"""
+Sparse order keys for entries
+
+Entry.order is a sort key, not a display number: keys are spaced ORDER_GAP
+apart so moving an entry only assigns it a key between its new neighbours.
+Display numbers (#1, #2, ...) are derived from position at render time.
+"""
+from typing import Dict, List, Optional
+
+ORDER_GAP = 1024
+
+
+def key_between(before: Optional[int], after: Optional[int]) -> Optional[int]:
+    """Pick an order key strictly between two neighbouring keys.
+
+    Args:
+        before: Key of the entry above the new position (None = top)
+        after: Key of the entry below the new position (None = bottom)
+
+    Returns:
+        The new key, or None if the neighbours leave no gap
+    """
+    low = before if before is not None else 0
+    if after is None:
+        return low + ORDER_GAP
+    if after - low >= 2:
+        return low + (after - low) // 2
+    return None
+
+
+def spread_keys(count: int) -> List[int]:
+    """Evenly spaced keys for count entries (used when rebalancing)"""
+    return [ORDER_GAP * (i + 1) for i in range(count)]
+
+
+def relabel_window(keys: List[Optional[int]], index: int) -> Dict[int, int]:
+    """Make room at keys[index] by relabelling as few neighbours as possible.
+
+    The window around index is doubled until the keys just outside it leave
+    enough room for every position inside it; the window is then spread
+    evenly over that room.
+
+    Args:
+        keys: Sorted order keys, with None at the position being filled
+        index: Position of the None placeholder
+
+    Returns:
+        Mapping of position to new key for every position in the window
+    """
+    n = len(keys)
+    radius = 1
+    while True:
+        lo = max(0, index - radius)
+        hi = min(n, index + radius + 1)
+        left = keys[lo - 1] if lo > 0 else 0
+        right = keys[hi] if hi < n else None
+        count = hi - lo
+
+        if right is None:
+            return {p: left + ORDER_GAP * (i + 1) for i, p in enumerate(range(lo, hi))}
+        if right - left > count:
+            step = (right - left) // (count + 1)
+            return {p: left + step * (i + 1) for i, p in enumerate(range(lo, hi))}
+        radius *= 2
@@ -1,15 +1,21 @@
 
 from pathlib import Path
-import json
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import List
+from typing import Dict, Iterator, List, Optional
 from PIL import Image
-from jinja2 import Environment, FileSystemLoader
-from app.core.models import Entry
+from app.core.models import Entry, EntryHeader
+from app.core.backends import BatchChanges, open_backend
+from app.core.ordering import ORDER_GAP, key_between, relabel_window, spread_keys
+from app.core.export import (
+    EXPORT_FORMATS, PACKAGE_TEMPLATES, PAGE_SIZE, PAGES_DIR, ReportJob, build_assets,
+    get_environment, render_formats, render_pages, template_references
+)
 
 DEFAULT_REPORT_MD_J2 = '''# Overlay Annotator Session
 
 {% for e in entries %}
+{% block entry scoped %}
 ## {{ e.title }}
 Captured: {{ e.timestamp }}
 
@@ -17,15 +23,24 @@ Captured: {{ e.timestamp }}
 |---|---|
 | ![{{ e.title }}]({{ e.image.path }}) | {{ e.notes }} |
 
+{% endblock %}
 {% endfor %}
 '''
 
 class SessionStore:
-    def __init__(self, session_root: Path):
+    def __init__(self, session_root: Path, backend: Optional[str] = None):
+        """Open a session folder
+        
+        Args:
+            session_root: Session folder
+            backend: Storage backend for a new session ("files" or "sqlite");
+                existing sessions keep the backend they were created with
+        """
         self.root = Path(session_root)
         self.images = self.root / "images"
         self.meta = self.root / "metadata"
         self.tpl_dir = self.root / "_templates"
+        self.cache_dir = self.root / ".cache"  # Export fragment cache
         self.tpl_dir.mkdir(exist_ok=True)
         
         # Create default Markdown template
@@ -45,23 +60,30 @@ class SessionStore:
                 # Fallback: create minimal HTML template
                 default_html_tpl.write_text(self._get_default_html_template(), encoding="utf-8")
         
+        # Entries and session metadata live in a pluggable backend
+        self.backend = open_backend(self.meta, backend)
+        self._batch: Optional[BatchChanges] = None
+        
+        # Set when a move had to relabel neighbours because order keys ran
+        # out of gaps; the UI calls rebalance_orders() when idle
+        self.needs_rebalance = False
+        
         # V3.5: Initialize session metadata
         self.metadata = self.load_session_metadata()
+        if self.metadata.max_order < self.backend.max_order():
+            self.repair_order_counter()
     
     def load_session_metadata(self):
         """V3.5: Load session metadata"""
         from app.core.models import SessionMetadata
-        metadata_file = self.meta / "session.json"
-        if metadata_file.exists():
-            try:
-                data = json.loads(metadata_file.read_text(encoding="utf-8"))
+        try:
+            data = self.backend.load_metadata()
+            if data is not None:
                 return SessionMetadata(**data)
-            except:
-                # Create default if loading fails
-                return SessionMetadata.new()
-        else:
-            # Create default
-            return SessionMetadata.new()
+        except:
+            # Create default if loading fails
+            pass
+        return SessionMetadata.new()
     
     def save_session_metadata(self, metadata=None):
         """V3.5: Save session metadata"""
@@ -70,103 +92,343 @@ class SessionStore:
             metadata = self.metadata
         
         metadata.last_modified = datetime.now(timezone.utc).isoformat()
-        self.meta.mkdir(exist_ok=True, parents=True)  # Ensure directory exists
-        metadata_file = self.meta / "session.json"
-        metadata_file.write_text(metadata.model_dump_json(indent=2), encoding="utf-8")
         self.metadata = metadata
+        with self.batch() as changes:
+            changes.metadata = metadata.model_dump()
+    
+    @contextmanager
+    def batch(self):
+        """Collect entry writes and metadata updates and commit them together
+        
+        Inside the block, save_entry, set_entry_orders, delete_entry and
+        save_session_metadata only record their changes; they are committed
+        in one pass with a single durable flush when the block exits, or
+        discarded if it raises. Nested batches join the outermost one. Reads
+        inside the block see the state as of the last commit.
+        
+        Example:
+            with store.batch():
+                for entry in entries:
+                    store.save_entry(entry)
+                store.save_session_metadata()
+        """
+        if self._batch is not None:
+            yield self._batch
+            return
+        
+        self._batch = BatchChanges()
+        try:
+            yield self._batch
+            changes = self._batch
+        finally:
+            self._batch = None
+        if not changes.is_empty():
+            self.backend.apply(changes)
 
     def save_image(self, pil: Image.Image) -> Path:
+        path = self.reserve_image_path()
+        self.write_image(pil, path)
+        return path
+
+    def reserve_image_path(self, entry_id: Optional[str] = None) -> Path:
+        """Pick a unique image path (relative to the session root) up front
+
+        Lets the UI build the entry before the image is encoded. The entry id
+        keeps names unique when several captures land in the same second.
+        """
         ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        path = self.images / f"entry_{ts}.jpg"
+        name = f"entry_{ts}_{entry_id}.jpg" if entry_id else f"entry_{ts}.jpg"
+        return (self.images / name).relative_to(self.root)
+
+    def write_image(self, pil: Image.Image, rel_path: Path) -> None:
+        """Encode and write an image to a reserved path
+
+        Touches only the image file, so the save pipeline runs it off the GUI
+        thread. Writes via a temp file so a half-written JPEG never appears.
+        """
+        path = self.root / rel_path
         self.images.mkdir(exist_ok=True, parents=True)
-        pil.convert("RGB").save(path, "JPEG", quality=95, optimize=True, progressive=True)
-        return path.relative_to(self.root)
+        tmp = path.with_name(path.name + ".tmp")
+        pil.convert("RGB").save(tmp, "JPEG", quality=95, optimize=True, progressive=True)
+        tmp.replace(path)
 
     def save_entry(self, entry: Entry) -> None:
-        self.meta.mkdir(exist_ok=True, parents=True)
+        with self.batch() as changes:
+            # V3.5.4: Auto-assign order if not set (O(1) via the session counter)
+            if entry.order == 0:
+                entry.order = self.metadata.max_order + ORDER_GAP
+            self._note_order(entry.order, changes)
+            
+            changes.deletes.discard(entry.id)
+            changes.orders.pop(entry.id, None)
+            changes.puts[entry.id] = entry
+    
+    def set_entry_orders(self, orders: Dict[str, int]) -> None:
+        """Reassign the order of several entries in one write
         
-        # V3.5.4: Auto-assign order if not set
-        if entry.order == 0:
-            entries = self.load_entries()
-            max_order = max([e.order for e in entries], default=0)
-            entry.order = max_order + 1
+        Args:
+            orders: Mapping of entry id to new order value
+        """
+        with self.batch() as changes:
+            for entry_id, order in orders.items():
+                if entry_id in changes.puts:
+                    changes.puts[entry_id].order = order
+                elif entry_id not in changes.deletes:
+                    changes.orders[entry_id] = order
+            if orders:
+                self._note_order(max(orders.values()), changes)
+    
+    def repair_order_counter(self) -> None:
+        """Reset SessionMetadata.max_order from the entries themselves
         
-        path = self.meta / f"{entry.id}.json"
-        try:
-            data = entry.model_dump()
-        except AttributeError:
-            data = entry.dict()
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
+        Needed for sessions written before the counter existed, or edited
+        by something that did not maintain it.
+        """
+        self.metadata.max_order = self.backend.max_order()
+        self.save_session_metadata()
+    
+    def _note_order(self, order: int, changes: BatchChanges) -> None:
+        """Advance the persisted order counter past an assigned key"""
+        if order > self.metadata.max_order:
+            self.metadata.max_order = order
+            changes.metadata = self.metadata.model_dump()
 
-    def load_entries(self) -> List[Entry]:
-        out: List[Entry] = []
-        for p in sorted(self.meta.glob("*.json")):
-            # Skip session.json (V3.5 metadata file)
-            if p.name == "session.json":
-                continue
-            with open(p, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                out.append(Entry(**data))
-        
-        # V3.5.4: Sort by order field (0 = use timestamp order)
-        out.sort(key=lambda e: (e.order if e.order > 0 else 999999, e.timestamp))
-        return out
+    def move_entry(self, entry_id: str, new_index: int) -> None:
+        """Move an entry to a new display position
+        
+        Only the moved entry is rewritten as long as its new neighbours leave
+        a gap between their order keys. Otherwise a small window of
+        neighbours is relabelled and needs_rebalance is set.
+        
+        Args:
+            entry_id: Entry to move
+            new_index: 0-based position in the full display order
+        """
+        entries = list(self.iter_headers())
+        others = [e for e in entries if e.id != entry_id]
+        if len(others) == len(entries):
+            return
+        new_index = max(0, min(new_index, len(others)))
+        
+        with self.batch():
+            # Entries without an explicit order (0) sort last; give them keys
+            # so every position has a neighbour key to split
+            keys = [e.order for e in others]
+            top = max([k for k in keys if k > 0], default=0)
+            unordered = {}
+            for i, e in enumerate(others):
+                if e.order <= 0:
+                    top += ORDER_GAP
+                    keys[i] = unordered[e.id] = top
+            self.set_entry_orders(unordered)
+            
+            before = keys[new_index - 1] if new_index > 0 else None
+            after = keys[new_index] if new_index < len(keys) else None
+            key = key_between(before, after)
+            if key is not None:
+                self.set_entry_orders({entry_id: key})
+                return
+            
+            # Gaps ran out: relabel the fewest neighbours that make room
+            ids = [e.id for e in others]
+            ids.insert(new_index, entry_id)
+            keys.insert(new_index, None)
+            window = relabel_window(keys, new_index)
+            self.set_entry_orders({ids[pos]: k for pos, k in window.items()})
+            self.needs_rebalance = True
+    
+    def rebalance_orders(self) -> None:
+        """Respace all order keys evenly, keeping the current display order"""
+        entries = list(self.iter_headers())
+        orders = {
+            e.id: key for e, key in zip(entries, spread_keys(len(entries)))
+            if e.order != key
+        }
+        self.set_entry_orders(orders)
+        self.needs_rebalance = False
 
-    def export_markdown(self) -> Path:
-        """Export session as Markdown (V3.5: with report_title)"""
+    def load_entries(self, location_type: Optional[str] = None) -> List[Entry]:
+        """Return entries sorted by display order.
+        
+        Args:
+            location_type: Only return entries of this location type
+        
+        The returned Entry objects may be shared with the store's cache, so
+        mutate them only to pass them back to save_entry().
+        """
+        return self.backend.all_entries(location_type)
+    
+    def iter_headers(self, location_type: Optional[str] = None) -> Iterator[EntryHeader]:
+        """Iterate lightweight entry headers in display order
+        
+        Headers carry id, title, order, timestamp and location_type only,
+        which is all list views, stats and the type filter need. Use
+        get_entry() to materialize the full Entry when one is opened.
+        
+        Args:
+            location_type: Only yield headers of this location type
+        """
+        return iter(self.backend.headers(location_type))
+    
+    def get_entry(self, entry_id: str) -> Optional[Entry]:
+        """Full Entry for an id (built on first access), or None if unknown"""
+        return self.backend.get_entry(entry_id)
+    
+    def entry_count(self) -> int:
+        """Number of entries in the session"""
+        return sum(self.count_by_location_type().values())
+    
+    def count_by_location_type(self) -> Dict[str, int]:
+        """Number of entries per location type ("web", "app", "mobile", "other")"""
+        return self.backend.count_by_location_type()
+    
+    def compact(self) -> None:
+        """Reclaim space from superseded entry records"""
+        self.backend.compact()
+    
+    def close(self) -> None:
+        """Release the storage backend"""
+        self.backend.close()
+
+    def report_template_dirs(self, name: str, autoescape: bool, needs=()) -> List[Path]:
+        """Template search path for a report that relies on some template variables
+        
+        Session templates are copied from the package when the session is
+        created and never updated. If the session's copy of a template does
+        not read every name in needs (it predates that feature), the
+        packaged template is used instead, so the report never silently
+        loses images or navigation.
+        
+        Args:
+            name: Template name
+            autoescape: HTML autoescaping (as for get_environment())
+            needs: Variable or attribute names the template must read
+        """
+        dirs = [self.tpl_dir, PACKAGE_TEMPLATES]
+        env = get_environment(dirs, autoescape=autoescape, bytecode_dir=self.cache_dir / "jinja")
+        missing = set(needs) - template_references(env, name)
+        if not missing:
+            return dirs
+        print(f"Warning: {self.tpl_dir / name} does not support {', '.join(sorted(missing))}; "
+              f"using the packaged template")
+        return [PACKAGE_TEMPLATES]
+    
+    def export(self, formats=("md", "html"), recompress_quality: Optional[int] = None,
+               linked_assets: bool = False) -> Dict[str, Path]:
+        """Export the session in several formats with one pass over the entries
+        
+        Entries are loaded and dumped once and each image is read and encoded
+        once, then fed to every format's template in lockstep. Formats are
+        looked up in export.EXPORT_FORMATS ("md", "html", or any added with
+        register_format()).
+        
+        Templates that wrap each entry in {% block entry scoped %} are
+        rendered incrementally: fragments are cached under .cache/ and only
+        changed or new entries are rendered (and have their images encoded).
+        A format whose output would not change is not rewritten.
+        
+        Args:
+            formats: Format names
+            recompress_quality: Re-encode embedded images as JPEG at this
+                quality to shrink the report (None embeds them as saved)
+            linked_assets: Instead of embedding images, write downscaled web
+                copies and thumbnails to assets/ and reference them (lazy
+                loaded, with srcset); clicking one opens the full image.
+                Session templates that predate this are replaced by the
+                packaged template for the export (see report_template_dirs())
+        
+        Returns:
+            Output path per format name
+        """
         from datetime import datetime
         
+        unknown = [name for name in formats if name not in EXPORT_FORMATS]
+        if unknown:
+            raise ValueError(f"Unknown export format: {', '.join(unknown)}")
+        
         entries = self.load_entries()
-        env = Environment(loader=FileSystemLoader(str(self.tpl_dir)), autoescape=False)
-        tpl = env.get_template("report.md.j2")
+        if linked_assets and any(EXPORT_FORMATS[name].images for name in formats):
+            build_assets(self.root, entries)
         
-        # Convert entries to dicts for template
-        entries_dicts = [entry.model_dump() for entry in entries]
+        export_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        jobs = {}
+        for name in formats:
+            fmt = EXPORT_FORMATS[name]
+            linked = linked_assets and fmt.images
+            dirs = self.report_template_dirs(fmt.template, fmt.autoescape,
+                                             needs=("assets",) if linked else ())
+            env = get_environment(dirs, autoescape=fmt.autoescape,
+                                  bytecode_dir=self.cache_dir / "jinja")
+            jobs[name] = ReportJob(
+                env, fmt.template, self.root / fmt.output, entries, self.root,
+                cache_dir=self.cache_dir / fmt.output,
+                embed_images=fmt.images,
+                recompress_quality=recompress_quality,
+                linked_assets=linked,
+                session_name=self.root.name,
+                report_title=self.metadata.report_title,
+                export_date=export_date
+            )
+        render_formats(list(jobs.values()), entries, self.root,
+                       recompress_quality=recompress_quality, linked_assets=linked_assets)
+        return {name: job.out for name, job in jobs.items()}
+    
+    def export_markdown(self) -> Path:
+        """Export session as Markdown (V3.5: with report_title)"""
+        return self.export(["md"])["md"]
+    
+    def export_html(self, recompress_quality: Optional[int] = None,
+                    linked_assets: bool = False) -> Path:
+        """Export session as HTML with embedded base64 images (V3.5: with report_title)
         
-        md = tpl.render(
-            entries=entries_dicts,
-            report_title=self.metadata.report_title,
-            export_date=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        )
-        out = self.root / "report.md"
-        out.write_text(md, encoding="utf-8")
-        return out
-    def export_html(self) -> Path:
-        """Export session as HTML with embedded base64 images (V3.5: with report_title)"""
-        import base64
+        See export() for the options.
+        """
+        return self.export(["html"], recompress_quality=recompress_quality,
+                           linked_assets=linked_assets)["html"]
+    
+    def export_html_pages(self, page_size: int = PAGE_SIZE,
+                          recompress_quality: Optional[int] = None,
+                          linked_assets: bool = False) -> Path:
+        """Export session as paginated HTML in report_pages/
+        
+        Writes page-001.html, page-002.html, ... with page_size entries each
+        and previous/next navigation, an index.html listing every page and
+        entry, and toc.json with the same table of contents. Pages are
+        rendered in parallel and cached like export_html(). A session
+        template that does not handle page and entry_offset is replaced by
+        the packaged one (see report_template_dirs()).
+        
+        Args:
+            page_size: Entries per page
+            recompress_quality: As for export_html()
+            linked_assets: As for export_html()
+        
+        Returns:
+            Path of report_pages/index.html
+        """
         from datetime import datetime
         
         entries = self.load_entries()
+        if linked_assets:
+            build_assets(self.root, entries)
         
-        # Convert entries to dicts and add base64 images
-        entries_with_images = []
-        for entry in entries:
-            # Convert to dict
-            entry_dict = entry.model_dump()
-            
-            # Add base64 image
-            img_path = self.root / entry.image.path
-            if img_path.exists():
-                with open(img_path, 'rb') as f:
-                    img_data = f.read()
-                    entry_dict['image_base64'] = base64.b64encode(img_data).decode('utf-8')
-            else:
-                entry_dict['image_base64'] = None
-            
-            entries_with_images.append(entry_dict)
-        
-        env = Environment(loader=FileSystemLoader(str(self.tpl_dir)), autoescape=True)
-        tpl = env.get_template("report.html.j2")
-        html = tpl.render(
-            entries=entries_with_images,
+        # Pages need navigation, entry anchors and numbering that continues
+        # across pages; the index template ships with the package
+        needs = ("page", "entry_offset") + (("assets",) if linked_assets else ())
+        return render_pages(
+            self.report_template_dirs("report.html.j2", autoescape=True, needs=needs),
+            "report.html.j2",
+            self.root / PAGES_DIR, entries, self.root,
+            cache_dir=self.cache_dir / PAGES_DIR,
+            bytecode_dir=self.cache_dir / "jinja",
+            page_size=page_size,
+            embed_images=not linked_assets,
+            recompress_quality=recompress_quality,
+            linked_assets=linked_assets,
             session_name=self.root.name,
             report_title=self.metadata.report_title,
             export_date=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         )
-        out = self.root / "report.html"
-        out.write_text(html, encoding="utf-8")
-        return out
     
     def delete_entry(self, entry: Entry) -> None:
         """Delete an entry and its associated files (V3.5.4)
@@ -175,10 +437,11 @@ class SessionStore:
             entry: Entry to delete
         """
         try:
-            # Delete metadata file
-            meta_file = self.meta / f"{entry.id}.json"
-            if meta_file.exists():
-                meta_file.unlink()
+            # Delete entry metadata
+            with self.batch() as changes:
+                changes.puts.pop(entry.id, None)
+                changes.orders.pop(entry.id, None)
+                changes.deletes.add(entry.id)
             
             # Delete image file
             image_path = self.root / entry.image.path
@@ -195,9 +458,10 @@ class SessionStore:
 .entry{background:white;margin:20px 0;padding:20px;border-radius:8px}
 img{max-width:100%;height:auto}</style></head><body>
 <h1>{{ session_name }}</h1><p>Generated: {{ export_date }}</p>
-{% for entry in entries %}
+{% for entry in entries %}{% block entry scoped %}
 <div class="entry"><h2>{{ entry.title }}</h2>
 <p>{{ entry.timestamp }}</p>
-{% if entry.image_base64 %}<img src="data:image/jpeg;base64,{{ entry.image_base64 }}">{% endif %}
+{% if entry.assets %}<a href="{{ entry.assets.full }}"><img src="{{ entry.assets.web }}" srcset="{{ entry.assets.thumb }} {{ entry.assets.thumb_width }}w, {{ entry.assets.web }} {{ entry.assets.web_width }}w" loading="lazy" alt="{{ entry.title }}"></a>
+{% elif entry.image_base64 %}<img src="data:image/jpeg;base64,{{ entry.image_base64 }}">{% endif %}
 <p>{{ entry.notes }}</p></div>
-{% endfor %}</body></html>'''
+{% endblock %}{% endfor %}</body></html>'''
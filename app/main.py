@@ -7,6 +7,7 @@ from pathlib import Path
 import sys
 import faulthandler
 import os
+import time
 
 # Enable faulthandler only if stderr is available (fails in PyInstaller windowed mode)
 if sys.stderr is not None:
@@ -28,7 +29,8 @@ except ImportError:
     HOTKEY_AVAILABLE = False
 
 from app.ui.main_window import MainWindow
-from app.ui.capture_overlay import CaptureOverlay
+from app.ui.capture_engine import CaptureEngine, CAPTURE_ALL, CAPTURE_MONITOR
+from app.ui import fonts
 from app.core.logger import setup_logging, exception_hook, log_exception
 
 ROOT = Path(__file__).resolve().parent
@@ -50,13 +52,23 @@ class DocShotApp:
             self.app = QApplication(sys.argv)
             self.app.setApplicationName("DocShot")
             self.app.setApplicationDisplayName("DocShot")
+            fonts.warm_up()  # Annotation fonts, before the first text tool use
             self.root = ROOT
             self.main_window = MainWindow(
                 project_root=self.root, 
                 logger=self.logger,
                 app_instance=self
             )
-            self.capture_overlay = None
+            # Pre-created so the hotkey only has to grab and show
+            self.capture_engine = CaptureEngine(
+                on_region_selected=self.main_window.handle_captured_region,
+                logger=self.logger
+            )
+            self.capture_overlay = self.capture_engine.overlay
+            self.main_window.chk_capture_monitor.toggled.connect(
+                lambda on: self.capture_engine.set_mode(CAPTURE_MONITOR if on else CAPTURE_ALL)
+            )
+            self.main_window.chk_regrab.toggled.connect(self.capture_engine.set_regrab_selection)
             self.hk_capture = None
             
             self.logger.info("Application initialized successfully")
@@ -65,16 +77,11 @@ class DocShotApp:
             self.logger.error("Failed to initialize application", exc_info=True)
             raise
         
-    def show_capture_overlay(self):
+    def show_capture_overlay(self, triggered_at=None):
         """Show the transparent capture overlay"""
         try:
             self.logger.info("Showing capture overlay...")
-            if self.capture_overlay is None:
-                self.capture_overlay = CaptureOverlay(
-                    on_region_selected=self.main_window.handle_captured_region,
-                    logger=self.logger
-                )
-            self.capture_overlay.start_capture()
+            self.capture_engine.capture(triggered_at)
         except Exception as e:
             self.logger.error("Error showing capture overlay", exc_info=True)
             log_exception(self.logger)
@@ -96,9 +103,10 @@ class DocShotApp:
             # Create QHotkey instance with parent
             self.hk_capture = QHotkey("Ctrl+Alt+S", parent=self.main_window, register=True)
             
-            # Connect to slot via QTimer for thread safety
+            # Connect to slot via QTimer for thread safety; the timestamp
+            # is taken when the hotkey fires so latency covers the queueing
             self.hk_capture.activated.connect(
-                lambda: QTimer.singleShot(0, self.show_capture_overlay)
+                lambda: self._queue_capture(time.perf_counter())
             )
             
             self.logger.info("Hotkey registered successfully - Ctrl+Alt+S active")
@@ -106,6 +114,9 @@ class DocShotApp:
         except Exception as e:
             self.logger.error("Failed to register hotkey", exc_info=True)
     
+    def _queue_capture(self, triggered_at):
+        QTimer.singleShot(0, lambda: self.show_capture_overlay(triggered_at))
+    
     def run(self):
         """Launch the application"""
         try:
@@ -113,7 +124,9 @@ class DocShotApp:
             self.main_window.show()
             
             self.logger.info("Application running - entering event loop")
-            return self.app.exec()
+            exit_code = self.app.exec()
+            self.capture_engine.close()
+            return exit_code
             
         except Exception as e:
             self.logger.critical("Application error", exc_info=True)
@@ -122,6 +135,10 @@ class DocShotApp:
 
 
 if __name__ == "__main__":
+    # Export workers run in a process pool; needed for the frozen exe
+    import multiprocessing
+    multiprocessing.freeze_support()
+    
     # Install global exception handler
     sys.excepthook = exception_hook
     
@@ -1,12 +1,19 @@
+from array import array
 from typing import Optional, List, Tuple
 from enum import Enum
 from dataclasses import dataclass
 from PyQt6.QtWidgets import QWidget, QInputDialog
-from PyQt6.QtGui import QPainter, QPen, QBrush, QColor, QMouseEvent, QFont, QImage, QPixmap
+from PyQt6.QtGui import QPainter, QPen, QColor, QMouseEvent, QImage, QPixmap
 from PyQt6.QtCore import Qt, QPoint, QRect, QMutex, QMutexLocker
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
+
+from app.ui.annotation_renderer import AnnotationRenderer
+from app.ui.fonts import text_metrics
 # ImageFilter removed in V3.5.3 - was only used for blur tool
 
+# Freehand strokes: minimum distance between kept points, in widget pixels
+PEN_MIN_STEP = 2.0
+
 
 class ToolType(Enum):
     """Available annotation tools"""
@@ -26,10 +33,58 @@ class Annotation:
     color: Optional[QColor] = None
     text: Optional[str] = None
     width: int = 3
+    # PEN only: flat x0, y0, x1, y1, ... in image coordinates
+    points: Optional[array] = None
     
     def __post_init__(self):
         if self.color is None:
             self.color = QColor(255, 0, 0)
+    
+    def add_point(self, pos: QPoint, min_step: float = 1.0) -> bool:
+        """Extend a freehand stroke, dropping points closer than min_step
+        
+        Returns True if the point was kept.
+        """
+        x, y = pos.x(), pos.y()
+        if self.points is None:
+            self.points = array('i', (self.start.x(), self.start.y()))
+        pts = self.points
+        dx, dy = x - pts[-2], y - pts[-1]
+        if dx * dx + dy * dy < min_step * min_step:
+            return False
+        pts.append(x)
+        pts.append(y)
+        self.end = pos
+        return True
+    
+    def simplify(self, tolerance: float):
+        """Ramer-Douglas-Peucker over a finished stroke (in place)"""
+        pts = self.points
+        if pts is None or len(pts) <= 4:
+            return
+        count = len(pts) // 2
+        keep = bytearray(count)
+        keep[0] = keep[-1] = 1
+        tol_sq = tolerance * tolerance
+        stack = [(0, count - 1)]
+        while stack:
+            first, last = stack.pop()
+            ax, ay = pts[2 * first], pts[2 * first + 1]
+            bx, by = pts[2 * last], pts[2 * last + 1]
+            sx, sy = bx - ax, by - ay
+            length_sq = sx * sx + sy * sy or 1
+            worst, worst_d = -1, tol_sq
+            for k in range(first + 1, last):
+                px, py = pts[2 * k] - ax, pts[2 * k + 1] - ay
+                cross = sx * py - sy * px
+                d = cross * cross / length_sq if sx or sy else px * px + py * py
+                if d > worst_d:
+                    worst, worst_d = k, d
+            if worst >= 0:
+                keep[worst] = 1
+                stack.append((first, worst))
+                stack.append((worst, last))
+        self.points = array('i', (v for k in range(count) if keep[k] for v in (pts[2 * k], pts[2 * k + 1])))
 
 
 class AnnotationCanvas(QWidget):
@@ -40,6 +95,14 @@ class AnnotationCanvas(QWidget):
         self.pil_image: Optional[Image.Image] = None
         self.q_image: Optional[QImage] = None  # Immutable backing image
         self._pixmap: Optional[QPixmap] = None  # Fast paint source
+        # Display-sized copy of _pixmap; rebuilt only on resize or new image
+        self._display_pixmap: Optional[QPixmap] = None
+        self._display_key = None  # (source cacheKey, display size)
+        # Committed annotations rasterized at widget size; the in-progress
+        # one is the only thing drawn live
+        self._layer: Optional[QPixmap] = None
+        self._layer_count = 0  # How many of self.annotations are in _layer
+        self._renderer = AnnotationRenderer.for_screen()
         self._mx = QMutex()  # Guard image swap for thread safety
         self.annotations: List[Annotation] = []
         self.current_annotation: Optional[Annotation] = None
@@ -78,6 +141,7 @@ class AnnotationCanvas(QWidget):
             self.pil_image = pil_img.copy()
             self.annotations.clear()
             self.current_annotation = None
+            self._layer = None
             
             # Method: Safe conversion with deep copy and mutex protection
             # Extract raw bytes and dimensions
@@ -111,6 +175,7 @@ class AnnotationCanvas(QWidget):
                 self.q_image = q_img
                 # Create QPixmap for fast painting
                 self._pixmap = QPixmap.fromImage(self.q_image)
+                self._display_pixmap = None
             
             # Keep the byte data alive too (extra safety)
             self._img_data = img_data
@@ -155,8 +220,7 @@ class AnnotationCanvas(QWidget):
                         text=text,
                         width=self.tool_width
                     )
-                    self.annotations.append(annotation)
-                    self.update()
+                    self._commit_annotation(annotation)
             else:
                 # Other tools: start annotation
                 self.current_annotation = Annotation(
@@ -166,8 +230,10 @@ class AnnotationCanvas(QWidget):
                     color=self.tool_color,
                     width=self.tool_width
                 )
+                if self.active_tool == ToolType.PEN:
+                    self.current_annotation.points = array('i', (pos.x(), pos.y()))
                 self.is_drawing = True
-                self.update()
+                self.update(self._annotation_bounds(self.current_annotation))
     
     def mouseMoveEvent(self, event: QMouseEvent):
         """Update annotation while drawing"""
@@ -175,8 +241,20 @@ class AnnotationCanvas(QWidget):
             # V3.6.1 BUG FIX: Map widget coordinates to image coordinates
             pos = self._map_to_image_coords(event.pos())
             if pos:
-                self.current_annotation.end = pos
-                self.update()
+                self._move_current(pos)
+    
+    def _move_current(self, pos: QPoint):
+        """Move the end of (or extend) the annotation being drawn"""
+        annotation = self.current_annotation
+        if annotation.points is not None:
+            # Only the stroke's tail changes; the rest is already on screen
+            dirty = self._stroke_bounds(annotation, tail=True)
+            if annotation.add_point(pos, PEN_MIN_STEP / getattr(self, '_scale_factor', 1.0)):
+                self.update(dirty.united(self._stroke_bounds(annotation, tail=True)))
+            return
+        dirty = self._annotation_bounds(annotation)
+        annotation.end = pos
+        self.update(dirty.united(self._annotation_bounds(annotation)))
     
     def mouseReleaseEvent(self, event: QMouseEvent):
         """Finish annotation"""
@@ -185,13 +263,15 @@ class AnnotationCanvas(QWidget):
                 # V3.6.1 BUG FIX: Map widget coordinates to image coordinates
                 pos = self._map_to_image_coords(event.pos())
                 if pos:
-                    self.current_annotation.end = pos
+                    self._move_current(pos)
                 # V3.5.3: Blur tool removed, just append all annotations
-                self.annotations.append(self.current_annotation)
+                annotation = self.current_annotation
+                # Half a screen pixel is invisible at this zoom level
+                annotation.simplify(0.5 / getattr(self, '_scale_factor', 1.0))
                 self.current_annotation = None
+                self._commit_annotation(annotation)
                 
             self.is_drawing = False
-            self.update()
     
     def add_text_annotation(self, text: str):
         """Add text annotation at pending position"""
@@ -203,10 +283,10 @@ class AnnotationCanvas(QWidget):
                 text=text,
                 width=self.tool_width
             )
-            self.annotations.append(annotation)
             self.pending_text = False
             self.text_position = None
-            self.update()
+            self._commit_annotation(annotation)
+            self.update()  # Also clears the text cursor
     
     # V3.5.3: Blur tool removed - was causing ImageQt import errors and rarely used
     
@@ -214,13 +294,83 @@ class AnnotationCanvas(QWidget):
         """Remove last annotation"""
         if self.annotations:
             self.annotations.pop()
+            self._layer = None
             self.update()
     
     def clear_annotations(self):
         """Clear all annotations"""
         self.annotations.clear()
+        self._layer = None
         self.update()
     
+    def _commit_annotation(self, annotation: Annotation):
+        """Add a finished annotation, drawing it straight into the cached layer"""
+        self.annotations.append(annotation)
+        if self._layer is not None and self._layer_count == len(self.annotations) - 1:
+            painter = QPainter(self._layer)
+            try:
+                self._paint_annotations(painter, [annotation])
+            finally:
+                painter.end()
+            self._layer_count += 1
+        self.update(self._annotation_bounds(annotation))
+    
+    def _annotation_bounds(self, annotation: Optional[Annotation]) -> QRect:
+        """Widget area an annotation paints into (for partial updates)"""
+        if annotation is None or not annotation.start:
+            return QRect()
+        start = self._map_to_widget_coords(annotation.start)
+        if annotation.tool == ToolType.TEXT:
+            # Text hangs below and right of start, inside a padded box
+            pad = self._renderer.text_padding + 2
+            metrics = text_metrics()
+            return QRect(start.x() - pad, start.y() - pad,
+                         metrics.horizontalAdvance(annotation.text or "") + 2 * pad,
+                         metrics.height() + 2 * pad)
+        if annotation.points is not None:
+            return self._stroke_bounds(annotation)
+        end = self._map_to_widget_coords(annotation.end) if annotation.end else start
+        margin = annotation.width + 17  # Pen width plus the 15px arrowhead
+        return QRect(start, end).normalized().adjusted(-margin, -margin, margin, margin)
+    
+    def _stroke_bounds(self, annotation: Annotation, tail: bool = False) -> QRect:
+        """Widget bounds of a freehand stroke, or of its last two segments"""
+        pts = annotation.points[-6:] if tail else annotation.points
+        xs, ys = pts[0::2], pts[1::2]
+        top_left = self._map_to_widget_coords(QPoint(min(xs), min(ys)))
+        bottom_right = self._map_to_widget_coords(QPoint(max(xs), max(ys)))
+        margin = annotation.width + 2
+        return QRect(top_left, bottom_right).adjusted(-margin, -margin, margin, margin)
+    
+    def _annotation_layer(self) -> QPixmap:
+        """Transparent widget-sized pixmap holding every committed annotation
+        
+        Rebuilt only after undo/clear, a resize or a new image; additions
+        are painted into it incrementally by _commit_annotation.
+        """
+        ratio = self.devicePixelRatioF()
+        size = self.size() * ratio
+        if self._layer is None or self._layer.size() != size or \
+                self._layer_count != len(self.annotations):
+            layer = QPixmap(size)
+            layer.setDevicePixelRatio(ratio)
+            layer.fill(Qt.GlobalColor.transparent)
+            painter = QPainter(layer)
+            try:
+                self._paint_annotations(painter, self.annotations)
+            finally:
+                painter.end()
+            self._layer = layer
+            self._layer_count = len(self.annotations)
+        return self._layer
+    
+    def _paint_annotations(self, painter: QPainter, annotations: List[Annotation]):
+        """Draw annotations (image coordinates) over the displayed image"""
+        if not hasattr(self, '_display_rect') or not hasattr(self, '_scale_factor'):
+            self._renderer.paint(painter, annotations)
+            return
+        self._renderer.paint(painter, annotations, self._scale_factor, self._display_rect.topLeft())
+    
     def _map_to_image_coords(self, widget_pos: QPoint) -> Optional[QPoint]:
         """Map widget coordinates to image coordinates (V3.6.1)
         
@@ -261,6 +411,35 @@ class AnnotationCanvas(QWidget):
         
         return QPoint(widget_x, widget_y)
     
+    def resizeEvent(self, event):
+        """Drop the display-sized caches; the next paint rebuilds them once"""
+        self._display_pixmap = None
+        self._layer = None
+        super().resizeEvent(event)
+    
+    def _scaled_pixmap(self, source: QPixmap, target_rect: QRect) -> QPixmap:
+        """Smooth-scaled copy of the capture at display size, cached
+        
+        Drawing the full-resolution pixmap into target_rect with
+        SmoothPixmapTransform rescales the whole capture on every paint,
+        which makes drawing over large captures lag behind the mouse.
+        """
+        cached = self._display_pixmap
+        if cached is not None and self._display_key == (source.cacheKey(), target_rect.size()):
+            return cached
+        
+        ratio = self.devicePixelRatioF()
+        scaled = source.scaled(
+            max(1, round(target_rect.width() * ratio)),
+            max(1, round(target_rect.height() * ratio)),
+            Qt.AspectRatioMode.IgnoreAspectRatio,
+            Qt.TransformationMode.SmoothTransformation
+        )
+        scaled.setDevicePixelRatio(ratio)
+        self._display_pixmap = scaled
+        self._display_key = (source.cacheKey(), target_rect.size())
+        return scaled
+    
     def paintEvent(self, event):
         """Draw image and annotations"""
         painter = QPainter(self)
@@ -300,20 +479,16 @@ class AnnotationCanvas(QWidget):
             self._display_rect = target_rect
             self._scale_factor = scale
             
-            # Use QPixmap for faster painting than QImage
-            painter.drawPixmap(target_rect, pixmap_copy)
+            # Pre-scaled pixmap: a plain blit, no per-frame resampling
+            painter.drawPixmap(target_rect.topLeft(), self._scaled_pixmap(pixmap_copy, target_rect))
             
-            # Draw all completed annotations
-            for annotation in self.annotations:
-                try:
-                    self._draw_annotation(painter, annotation)
-                except Exception as e:
-                    print(f"Warning: Failed to draw annotation: {e}")
+            # Draw all completed annotations (cached layer)
+            painter.drawPixmap(0, 0, self._annotation_layer())
             
             # Draw current annotation being created
             if self.current_annotation:
                 try:
-                    self._draw_annotation(painter, self.current_annotation)
+                    self._paint_annotations(painter, [self.current_annotation])
                 except Exception as e:
                     print(f"Warning: Failed to draw current annotation: {e}")
             
@@ -334,192 +509,21 @@ class AnnotationCanvas(QWidget):
             # CRITICAL: Always end the painter
             painter.end()
     
-    def _draw_annotation(self, painter: QPainter, annotation: Annotation):
-        """Draw a single annotation (V3.6.1: now maps image coords to widget coords)"""
-        pen = QPen(annotation.color, annotation.width)
-        painter.setPen(pen)
-        
-        if annotation.tool == ToolType.ARROW:
-            self._draw_arrow(painter, annotation)
-        elif annotation.tool == ToolType.BOX:
-            self._draw_box(painter, annotation)
-        elif annotation.tool == ToolType.PEN:
-            self._draw_line(painter, annotation)
-        elif annotation.tool == ToolType.TEXT:
-            self._draw_text(painter, annotation)
-    
-    def _draw_arrow(self, painter: QPainter, annotation: Annotation):
-        """Draw arrow annotation"""
-        if not annotation.start or not annotation.end:
-            return
-        
-        # V3.6.1: Map image coordinates to widget coordinates for display
-        start = self._map_to_widget_coords(annotation.start)
-        end = self._map_to_widget_coords(annotation.end)
-        
-        # Draw line
-        painter.drawLine(start, end)
-        
-        # Draw arrowhead
-        dx = end.x() - start.x()
-        dy = end.y() - start.y()
-        length = (dx**2 + dy**2)**0.5
-        
-        if length > 0:
-            # Normalize
-            dx, dy = dx/length, dy/length
-            # Arrowhead points
-            arrow_size = 15
-            left_x = end.x() - arrow_size * (dx + dy*0.5)
-            left_y = end.y() - arrow_size * (dy - dx*0.5)
-            right_x = end.x() - arrow_size * (dx - dy*0.5)
-            right_y = end.y() - arrow_size * (dy + dx*0.5)
-            
-            painter.setBrush(QBrush(annotation.color))
-            painter.drawPolygon([
-                end,
-                QPoint(int(left_x), int(left_y)),
-                QPoint(int(right_x), int(right_y))
-            ])
-    
-    def _draw_box(self, painter: QPainter, annotation: Annotation):
-        """Draw box annotation"""
-        if not annotation.start or not annotation.end:
-            return
-        
-        # V3.6.1: Map image coordinates to widget coordinates
-        start = self._map_to_widget_coords(annotation.start)
-        end = self._map_to_widget_coords(annotation.end)
-        
-        # CRITICAL FIX: Clear brush so box is not filled
-        painter.setBrush(Qt.BrushStyle.NoBrush)
-        
-        x1 = min(start.x(), end.x())
-        y1 = min(start.y(), end.y())
-        x2 = max(start.x(), end.x())
-        y2 = max(start.y(), end.y())
-        
-        painter.drawRect(x1, y1, x2 - x1, y2 - y1)
-    
-    def _draw_line(self, painter: QPainter, annotation: Annotation):
-        """Draw freehand line"""
-        if not annotation.start or not annotation.end:
-            return
-        
-        # V3.6.1: Map image coordinates to widget coordinates
-        start = self._map_to_widget_coords(annotation.start)
-        end = self._map_to_widget_coords(annotation.end)
-        
-        painter.drawLine(start, end)
-    
-    def _draw_text(self, painter: QPainter, annotation: Annotation):
-        """Draw text annotation"""
-        if not annotation.start or not annotation.text:
-            return
-        
-        # V3.6.1: Map image coordinates to widget coordinates
-        start = self._map_to_widget_coords(annotation.start)
-        
-        font = QFont("Arial", 14, QFont.Weight.Bold)
-        painter.setFont(font)
-        painter.setPen(QPen(annotation.color))
-        
-        # Draw background
-        metrics = painter.fontMetrics()
-        text_rect = metrics.boundingRect(annotation.text)
-        text_rect.moveTo(start)
-        text_rect.adjust(-5, -5, 5, 5)
-        
-        painter.fillRect(text_rect, QColor(255, 255, 255, 200))
-        painter.drawText(start, annotation.text)
-    
     def render_annotated(self) -> Image.Image:
         """Render final image with all annotations burned in at high quality (V3.6.1 FIXED)"""
-        if not self.pil_image:
-            return Image.new("RGB", (1, 1), "white")
-        
-        output = self.pil_image.copy()
-        draw = ImageDraw.Draw(output)
-        
-        # V3.6.1 CRITICAL FIX: Annotations are now stored in IMAGE coordinates,
-        # not widget coordinates, so NO SCALING is needed!
-        # The old code was double-scaling which caused the position shift bug.
-        
-        # Just use the image dimensions for quality calculations
-        w, h = output.size
-        
-        # QUALITY FIX: Use higher base width for better visibility
-        min_width = max(3, int(3 * (w / 1000)))  # Scale based on image size
-        
-        # Draw each annotation on PIL image
-        for annotation in self.annotations:
-            if annotation.tool == ToolType.TEXT and annotation.text:
-                # Draw text - coordinates are already in image space!
-                x = int(annotation.start.x())
-                y = int(annotation.start.y())
-                
-                # QUALITY FIX: Use larger font size scaled to image
-                font_size = max(24, int(32 * (h / 1000)))  # Scale font with image height
-                
-                # Try to load a good font
-                try:
-                    font = ImageFont.truetype("arial.ttf", font_size)
-                except:
-                    try:
-                        # Try common font locations
-                        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", font_size)
-                    except:
-                        # Fallback to default (will be small)
-                        font = ImageFont.load_default()
-                
-                # Draw white background for text
-                bbox = draw.textbbox((x, y), annotation.text, font=font)
-                draw.rectangle(bbox, fill=(255, 255, 255, 220))
-                
-                # Draw text with color
-                color = (annotation.color.red(), annotation.color.green(), annotation.color.blue())
-                draw.text((x, y), annotation.text, fill=color, font=font)
-            
-            elif annotation.tool in [ToolType.ARROW, ToolType.BOX, ToolType.PEN]:
-                if not annotation.start or not annotation.end:
-                    continue
-                
-                # V3.6.1 FIX: Coordinates are already in image space - use directly!
-                x1 = int(annotation.start.x())
-                y1 = int(annotation.start.y())
-                x2 = int(annotation.end.x())
-                y2 = int(annotation.end.y())
-                
-                color = (annotation.color.red(), annotation.color.green(), annotation.color.blue())
-                
-                # QUALITY FIX: Scale width based on image size
-                width = max(min_width, int(annotation.width * (w / 1000)))
-                
-                if annotation.tool == ToolType.BOX:
-                    # CRITICAL FIX: Normalize coordinates for boxes only
-                    # This prevents "x1 must be greater than or equal to x0" error
-                    box_x1, box_x2 = min(x1, x2), max(x1, x2)
-                    box_y1, box_y2 = min(y1, y2), max(y1, y2)
-                    draw.rectangle([box_x1, box_y1, box_x2, box_y2], outline=color, width=width)
-                    
-                elif annotation.tool in [ToolType.ARROW, ToolType.PEN]:
-                    # DON'T normalize arrows - direction matters!
-                    draw.line([x1, y1, x2, y2], fill=color, width=width)
-                    
-                    # Add arrowhead for arrows
-                    if annotation.tool == ToolType.ARROW:
-                        dx = x2 - x1
-                        dy = y2 - y1
-                        length = (dx**2 + dy**2)**0.5
-                        if length > 0:
-                            dx, dy = dx/length, dy/length
-                            # QUALITY FIX: Scale arrow size with image
-                            arrow_size = max(20, int(30 * (w / 1000)))
-                            pts = [
-                                (x2, y2),
-                                (int(x2 - arrow_size * (dx + dy*0.5)), int(y2 - arrow_size * (dy - dx*0.5))),
-                                (int(x2 - arrow_size * (dx - dy*0.5)), int(y2 - arrow_size * (dy + dx*0.5)))
-                            ]
-                            draw.polygon(pts, fill=color)
-        
-        return output
+        return render_annotations(self.pil_image, self.annotations)
+
+
+def render_annotations(pil_image: Optional[Image.Image],
+                       annotations: List[Annotation]) -> Image.Image:
+    """Burn annotations into a copy of an image at high quality (V3.6.1 FIXED)
+    
+    Uses the same QPainter renderer as the canvas, on a QImage, so it is
+    safe to run off the GUI thread (the save pipeline does) as long as the
+    caller passes a list the canvas will not mutate. Annotations are in
+    image coordinates and sizes scale with the image.
+    """
+    if not pil_image:
+        return Image.new("RGB", (1, 1), "white")
+    
+    return AnnotationRenderer.for_image(*pil_image.size).render(pil_image, annotations)
@@ -0,0 +1,275 @@
+"""
+QPainter renderer shared by the canvas and the saved image
+
+Annotations used to be drawn twice: with QPainter on the canvas and again
+with PIL ImageDraw when burned into the saved image, so every shape existed
+in two engines that drifted apart. AnnotationRenderer draws them once, onto
+any QPainter device: the canvas widget (scaled to fit, sizes in screen
+pixels) or a full-resolution QImage (sizes scaled with the image).
+
+Burning annotations into a saved image is slower than the PIL ImageDraw code
+it replaced, mostly because QPainter antialiases every stroke:
+bench_annotation_render.py measures about 1.5-2.5x the PIL time (around
+210 ms against 110 ms for 50 annotations on a 4K capture). That is
+acceptable only because render() runs on the save pipeline's writer thread,
+never on the GUI thread; painting on a QImage is safe there. render() copies
+only the tiles annotations touch into QImages, which with a few annotations
+on a 4K-8K capture is 2-3x faster than one full-image QImage pass (the
+two are even at about 50 annotations).
+
+Annotations are stored in image coordinates; the renderer maps them with
+the painter transform.
+"""
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from PyQt6.QtCore import QPointF, QRectF, Qt
+from PyQt6.QtGui import (QBrush, QColor, QFont, QFontMetricsF, QImage, QPainter, QPainterPath,
+                         QPainterPathStroker, QPen, QPolygon, QPolygonF)
+from PIL import Image
+
+from app.ui.fonts import image_qfont, text_qfont
+
+# Burn-in works on square tiles; only tiles an annotation touches are
+# copied into a QImage and back
+TILE_SIZE = 256
+
+
+class AnnotationRenderer:
+    """Draws annotations with QPainter; all sizes are in device pixels"""
+
+    def __init__(self, font: QFont, width_scale: float = 1.0, min_width: int = 1,
+                 arrow_size: int = 15, text_padding: int = 5,
+                 text_background: QColor = QColor(255, 255, 255, 200)):
+        self.font = font
+        self.width_scale = width_scale  # Multiplies Annotation.width
+        self.min_width = min_width
+        self.arrow_size = arrow_size
+        self.text_padding = text_padding
+        self.text_background = text_background
+
+    @classmethod
+    def for_screen(cls) -> "AnnotationRenderer":
+        """Canvas look: widths as chosen in the toolbar, 14pt text"""
+        return cls(text_qfont())
+
+    @classmethod
+    def for_image(cls, width: int, height: int) -> "AnnotationRenderer":
+        """Saved-image look: sizes grow with the image (V3.6.1 quality rules)"""
+        factor = width / 1000
+        return cls(
+            image_qfont(max(24, int(32 * (height / 1000)))),
+            width_scale=factor,
+            min_width=max(3, int(3 * factor)),
+            arrow_size=max(20, int(30 * factor)),
+            text_padding=max(4, int(5 * factor)),
+            text_background=QColor(255, 255, 255, 220),
+        )
+
+    def line_width(self, annotation) -> int:
+        return max(self.min_width, int(annotation.width * self.width_scale))
+
+    def text_box(self, annotation, metrics=None) -> QRectF:
+        """Background box of a text annotation, in device pixels at (0, 0)"""
+        metrics = metrics or QFontMetricsF(self.font)
+        pad = self.text_padding
+        return QRectF(-pad, -pad, metrics.horizontalAdvance(annotation.text) + 2 * pad,
+                      metrics.ascent() + metrics.descent() + 2 * pad)
+
+    def paint(self, painter: QPainter, annotations: Iterable, scale: float = 1.0,
+              offset: Optional[QPointF] = None):
+        """Draw annotations (image coordinates) at scale, shifted by offset"""
+        painter.save()
+        try:
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing, True)
+            painter.setRenderHint(QPainter.RenderHint.TextAntialiasing, True)
+            if offset is not None:
+                painter.translate(QPointF(offset))
+            if scale != 1.0:
+                painter.scale(scale, scale)
+            unit = 1 / scale  # One device pixel in image coordinates
+            for annotation in annotations:
+                try:
+                    self.draw(painter, annotation, unit)
+                except Exception as e:
+                    print(f"Warning: Failed to draw annotation: {e}")
+        finally:
+            painter.restore()
+
+    def draw(self, painter: QPainter, annotation, unit: float = 1.0):
+        """Draw one annotation; unit is the size of a device pixel"""
+        tool = annotation.tool.value
+        if tool == "text":
+            self._draw_text(painter, annotation)
+            return
+        if not annotation.start or not annotation.end:
+            return
+
+        pen = QPen(annotation.color, self.line_width(annotation) * unit)
+        if tool == "pen":
+            pen.setCapStyle(Qt.PenCapStyle.RoundCap)
+            pen.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
+        elif tool == "box":
+            pen.setJoinStyle(Qt.PenJoinStyle.MiterJoin)  # Square corners
+        painter.setPen(pen)
+        start, end = QPointF(annotation.start), QPointF(annotation.end)
+
+        if tool == "box":
+            # CRITICAL FIX: Clear brush so box is not filled
+            painter.setBrush(Qt.BrushStyle.NoBrush)
+            painter.drawRect(QRectF(start, end).normalized())
+
+        elif tool == "pen":
+            points = annotation.points
+            if points is not None and len(points) >= 4:
+                # Freehand stroke: one polyline
+                polygon = QPolygon()
+                polygon.setPoints(*points)
+                painter.drawPolyline(polygon)
+            else:
+                painter.drawLine(start, end)
+
+        elif tool == "arrow":
+            # DON'T normalize arrows - direction matters!
+            painter.drawLine(start, end)
+            dx = end.x() - start.x()
+            dy = end.y() - start.y()
+            length = (dx**2 + dy**2)**0.5
+            if length > 0:
+                dx, dy = dx/length, dy/length
+                size = self.arrow_size * unit
+                painter.setBrush(QBrush(annotation.color))
+                painter.drawPolygon(QPolygonF([
+                    end,
+                    QPointF(end.x() - size * (dx + dy*0.5), end.y() - size * (dy - dx*0.5)),
+                    QPointF(end.x() - size * (dx - dy*0.5), end.y() - size * (dy + dx*0.5)),
+                ]))
+
+    def _draw_text(self, painter: QPainter, annotation):
+        """Text with its top-left corner at start, on a light background"""
+        if not annotation.start or not annotation.text:
+            return
+        # Text is laid out in device pixels so it stays crisp when scaled
+        origin = painter.transform().map(QPointF(annotation.start))
+        metrics = QFontMetricsF(self.font)
+        painter.save()
+        try:
+            painter.resetTransform()
+            painter.translate(origin)
+            painter.fillRect(self.text_box(annotation, metrics), self.text_background)
+            painter.setFont(self.font)
+            painter.setPen(QPen(annotation.color))
+            painter.drawText(QPointF(0, metrics.ascent()), annotation.text)
+        finally:
+            painter.restore()
+
+    def outline(self, annotation) -> Optional[QPainterPath]:
+        """Area an annotation paints, at scale 1 (plus a pixel for antialiasing)"""
+        tool = annotation.tool.value
+        if tool == "text":
+            if not annotation.start or not annotation.text:
+                return None
+            path = QPainterPath()
+            path.addRect(self.text_box(annotation).translated(QPointF(annotation.start)).adjusted(-1, -1, 1, 1))
+            return path
+        if not annotation.start or not annotation.end:
+            return None
+
+        start, end = QPointF(annotation.start), QPointF(annotation.end)
+        path = QPainterPath()
+        if tool == "box":
+            path.addRect(QRectF(start, end).normalized())
+        elif tool == "pen" and annotation.points is not None and len(annotation.points) >= 4:
+            points = annotation.points
+            path.moveTo(points[0], points[1])
+            for k in range(2, len(points), 2):
+                path.lineTo(points[k], points[k + 1])
+        else:
+            path.moveTo(start)
+            path.lineTo(end)
+
+        stroker = QPainterPathStroker()
+        stroker.setWidth(self.line_width(annotation) + 2)
+        stroker.setCapStyle(Qt.PenCapStyle.RoundCap)
+        stroker.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
+        shape = stroker.createStroke(path)
+        if tool == "arrow":
+            # Arrowhead reaches arrow_size back from the end
+            size = self.arrow_size + 2
+            head = QPainterPath()
+            head.addEllipse(end, size, size)
+            shape = shape.united(head)
+        return shape
+
+    def _touched_tiles(self, annotations: List, width: int, height: int) -> Dict[Tuple[int, int], List[int]]:
+        """(column, row) -> indexes of the annotations painting into that tile"""
+        tiles: Dict[Tuple[int, int], List[int]] = {}
+        last_col, last_row = (width - 1) // TILE_SIZE, (height - 1) // TILE_SIZE
+        for index, annotation in enumerate(annotations):
+            shape = self.outline(annotation)
+            if shape is None:
+                continue
+            bounds = shape.boundingRect()
+            col0 = max(0, int(bounds.left()) // TILE_SIZE)
+            row0 = max(0, int(bounds.top()) // TILE_SIZE)
+            col1 = min(last_col, int(bounds.right()) // TILE_SIZE)
+            row1 = min(last_row, int(bounds.bottom()) // TILE_SIZE)
+            whole = col1 - col0 < 2 and row1 - row0 < 2  # Small shapes: skip the exact test
+            for row in range(row0, row1 + 1):
+                for col in range(col0, col1 + 1):
+                    if whole or shape.intersects(QRectF(col * TILE_SIZE, row * TILE_SIZE, TILE_SIZE, TILE_SIZE)):
+                        tiles.setdefault((col, row), []).append(index)
+        return tiles
+
+    def render(self, pil_image: Image.Image, annotations: Iterable) -> Image.Image:
+        """Burn annotations into a copy of a PIL image at full resolution
+
+        Only the tiles the annotations touch make the round trip through a
+        QImage; neighbouring touched tiles in a row are merged into one
+        band. Works on QImage only (no QPixmap), so it can run on a worker
+        thread. The result has the same mode as the input.
+        """
+        annotations = list(annotations)
+        mode = pil_image.mode
+        # RGB stays RGB (bands go through RGBX); other modes paint in RGBA
+        output = pil_image.copy() if mode in ("RGB", "RGBA") else pil_image.convert("RGBA")
+        width, height = output.size
+
+        tiles = self._touched_tiles(annotations, width, height)
+        for row in sorted({row for _, row in tiles}):
+            cols = sorted(col for col, r in tiles if r == row)
+            # Runs of adjacent columns become one band
+            start = prev = cols[0]
+            for col in cols[1:] + [None]:
+                if col is not None and col == prev + 1:
+                    prev = col
+                    continue
+                indexes: Set[int] = set()
+                for c in range(start, prev + 1):
+                    indexes.update(tiles[(c, row)])
+                self._render_band(output, [annotations[i] for i in sorted(indexes)],
+                                   start * TILE_SIZE, row * TILE_SIZE,
+                                   min(width, (prev + 1) * TILE_SIZE), min(height, (row + 1) * TILE_SIZE))
+                start = prev = col
+
+        return output if output.mode == mode else output.convert(mode)
+
+    def _render_band(self, output: Image.Image, annotations: List, x0: int, y0: int, x1: int, y1: int):
+        """Paint annotations into output[y0:y1, x0:x1] through a QImage"""
+        width, height = x1 - x0, y1 - y0
+        if output.mode == "RGB":
+            raw, fmt = "RGBX", QImage.Format.Format_RGBX8888
+        else:
+            raw, fmt = "RGBA", QImage.Format.Format_RGBA8888
+        data = output.crop((x0, y0, x1, y1)).tobytes("raw", raw)
+        image = QImage(data, width, height, width * 4, fmt)
+
+        painter = QPainter(image)  # Detaches from data on first write
+        try:
+            self.paint(painter, annotations, offset=QPointF(-x0, -y0))
+        finally:
+            painter.end()
+
+        bits = image.constBits()
+        bits.setsize(image.sizeInBytes())
+        band = Image.frombuffer(output.mode, (width, height), bits, "raw", raw, image.bytesPerLine(), 1)
+        output.paste(band, (x0, y0))  # Copies, so the QImage may go
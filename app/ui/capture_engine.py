@@ -0,0 +1,197 @@
+"""
+Long-lived capture engine behind the global hotkey
+
+Opening an mss handle, building the overlay window and querying the virtual
+desktop geometry on every capture all sit between the hotkey and the
+overlay appearing. The engine does that work once: the mss handle stays
+open, the overlay is created (hidden) up front, and the geometry is cached
+until Qt reports a screen change. Showing the overlay is driven by the
+grab_done signal instead of a fixed timer, and the hotkey-to-visible latency
+is measured for every capture.
+
+Two optional modes keep grabs small on multi-monitor setups: capturing only
+the monitor under the cursor (the overlay then covers just that screen), and
+re-grabbing only the selected rectangle when the mouse is released.
+"""
+import time
+from typing import Callable, Optional
+
+from PyQt6.QtCore import QObject, QRect, pyqtSignal
+from PyQt6.QtGui import QCursor
+from PyQt6.QtWidgets import QApplication
+from mss import mss
+from PIL import Image
+
+from app.ui.capture_overlay import CaptureOverlay
+
+# Capture modes
+CAPTURE_ALL = "all"  # Whole virtual desktop (every monitor)
+CAPTURE_MONITOR = "monitor"  # Only the monitor under the cursor
+
+
+class CaptureEngine(QObject):
+    """Owns the mss handle and the pre-created capture overlay"""
+
+    # Signals
+    grab_done = pyqtSignal()  # Screen grabbed into the overlay, ready to show
+    latency_measured = pyqtSignal(float, float)  # grab ms, hotkey-to-visible ms
+
+    def __init__(self, on_region_selected: Callable, logger=None, parent=None,
+                 mode: str = CAPTURE_ALL, regrab_selection: bool = False):
+        super().__init__(parent)
+        self.logger = logger
+        self.mode = mode
+        self._sct = None
+        self._monitor: Optional[dict] = None
+        self._geometry: Optional[QRect] = None
+        self._screen_monitors = {}  # QScreen name -> mss monitor
+        self._grabbed_monitor: Optional[dict] = None  # Area of the current grab
+        self._triggered_at: Optional[float] = None
+        self._grab_ms = 0.0
+        self._target_geometry: Optional[QRect] = None
+        self.last_latency_ms: Optional[float] = None
+
+        self.overlay = CaptureOverlay(on_region_selected=on_region_selected, logger=logger)
+        self.overlay.winId()  # Create the native window now, not on first capture
+        self.overlay.shown.connect(self._on_overlay_shown)
+        self.grab_done.connect(self._on_grab_done)
+        self.set_regrab_selection(regrab_selection)
+
+        # Monitors plugged, unplugged or rearranged invalidate the cached layout
+        app = QApplication.instance()
+        app.screenAdded.connect(self._on_screen_added)
+        app.screenRemoved.connect(self._on_screens_changed)
+        for screen in app.screens():
+            screen.virtualGeometryChanged.connect(self._on_screens_changed)
+
+        try:
+            self._open()
+        except Exception as e:
+            # Retried (and reported) on the first capture
+            self._sct = None
+            if self.logger:
+                self.logger.warning(f"Could not open screen capture yet: {e}")
+
+    def _open(self):
+        """Open the mss handle and cache the virtual desktop layout"""
+        self._sct = mss()
+        # CRITICAL FIX: Capture ALL monitors (monitor 0 = all screens combined)
+        self._monitor = self._sct.monitors[0]
+        self._geometry = QApplication.primaryScreen().virtualGeometry()
+        self._screen_monitors = {}
+        if self.logger:
+            g = self._geometry
+            self.logger.debug(
+                f"Capture engine ready: {g.x()}, {g.y()}, {g.width()}x{g.height()}"
+            )
+
+    def _on_screen_added(self, screen):
+        screen.virtualGeometryChanged.connect(self._on_screens_changed)
+        self._on_screens_changed()
+
+    def _on_screens_changed(self, *args):
+        # mss caches its monitor list per handle, so reopen it
+        if self.logger:
+            self.logger.info("Screen configuration changed - refreshing capture geometry")
+        self.close()  # Reopened lazily by the next capture
+
+    def set_mode(self, mode: str):
+        """Switch between CAPTURE_ALL and CAPTURE_MONITOR"""
+        if mode not in (CAPTURE_ALL, CAPTURE_MONITOR):
+            raise ValueError(f"Unknown capture mode: {mode}")
+        self.mode = mode
+
+    def set_regrab_selection(self, enabled: bool):
+        """Grab the selected rectangle fresh on release instead of cropping"""
+        self.overlay.region_grabber = self.grab_region if enabled else None
+
+    def _monitor_for(self, screen) -> dict:
+        """mss monitor matching a QScreen
+
+        Qt reports logical pixels and mss physical ones, so the screen's
+        geometry is scaled by its device pixel ratio and the closest mss
+        monitor wins.
+        """
+        name = screen.name()
+        if name not in self._screen_monitors:
+            g = screen.geometry()
+            ratio = screen.devicePixelRatio()
+            want = (g.x() * ratio, g.y() * ratio, g.width() * ratio, g.height() * ratio)
+            self._screen_monitors[name] = min(
+                self._sct.monitors[1:] or self._sct.monitors[:1],
+                key=lambda m: sum(
+                    abs(a - b) for a, b in zip(want, (m["left"], m["top"], m["width"], m["height"]))
+                ),
+            )
+        return self._screen_monitors[name]
+
+    def _target(self):
+        """mss area to grab and overlay geometry for the current mode"""
+        if self.mode == CAPTURE_MONITOR:
+            screen = QApplication.screenAt(QCursor.pos()) or QApplication.primaryScreen()
+            return self._monitor_for(screen), screen.geometry()
+        return self._monitor, self._geometry
+
+    def capture(self, triggered_at: Optional[float] = None):
+        """Grab the desktop and show the overlay
+
+        triggered_at is the time.perf_counter() value when the hotkey fired;
+        it defaults to now.
+        """
+        if self.overlay.isVisible():
+            return  # Already selecting
+        self._triggered_at = triggered_at if triggered_at is not None else time.perf_counter()
+        if self._sct is None:
+            self._open()
+
+        # CRITICAL FIX: Capture screen FIRST (before showing overlay)
+        # This prevents the overlay from being captured in the screenshot
+        monitor, self._target_geometry = self._target()
+        start = time.perf_counter()
+        if not self.overlay.grab_monitor(self._sct, monitor):
+            self._triggered_at = None
+            return
+        self._grab_ms = (time.perf_counter() - start) * 1000
+        self._grabbed_monitor = monitor
+        self.grab_done.emit()
+
+    def _on_grab_done(self):
+        self.overlay.show_overlay(self._target_geometry)
+
+    def grab_region(self, x1: int, y1: int, x2: int, y2: int) -> Optional[Image.Image]:
+        """Grab a rectangle (in pixels of the current grab) straight from the screen"""
+        monitor = self._grabbed_monitor
+        if monitor is None:
+            return None
+        x1, x2 = max(0, x1), min(monitor["width"], x2)
+        y1, y2 = max(0, y1), min(monitor["height"], y2)
+        if x2 <= x1 or y2 <= y1:
+            return None
+        if self._sct is None:
+            self._open()
+        shot = self._sct.grab({
+            "left": monitor["left"] + x1,
+            "top": monitor["top"] + y1,
+            "width": x2 - x1,
+            "height": y2 - y1,
+        })
+        return Image.frombytes("RGB", shot.size, bytes(shot.raw), "raw", "BGRX")
+
+    def _on_overlay_shown(self):
+        if self._triggered_at is None:
+            return
+        visible_ms = (time.perf_counter() - self._triggered_at) * 1000
+        self._triggered_at = None
+        self.last_latency_ms = visible_ms
+        if self.logger:
+            self.logger.info(
+                f"Capture latency: grab {self._grab_ms:.1f} ms, "
+                f"hotkey to visible {visible_ms:.1f} ms"
+            )
+        self.latency_measured.emit(self._grab_ms, visible_ms)
+
+    def close(self):
+        """Release the mss handle (reopened on the next capture)"""
+        if self._sct is not None:
+            self._sct.close()
+            self._sct = None
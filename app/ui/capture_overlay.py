@@ -3,7 +3,7 @@ Transparent full-screen overlay for region selection
 """
 from PyQt6.QtWidgets import QWidget, QApplication
 from PyQt6.QtCore import Qt, QRect, QPoint, pyqtSignal
-from PyQt6.QtGui import QPainter, QPen, QBrush, QColor, QPixmap
+from PyQt6.QtGui import QPainter, QPen, QBrush, QColor, QImage
 from mss import mss
 from PIL import Image
 from typing import Callable, Optional
@@ -12,18 +12,32 @@ import logging
 # Module logger
 logger = logging.getLogger('OverlayAnnotator.CaptureOverlay')
 
+# Time for the compositor to take the hidden overlay off screen before a
+# region re-grab
+REGRAB_DELAY_MS = 50
+
 
 class CaptureOverlay(QWidget):
     """Full-screen transparent overlay for capturing screen regions"""
     
+    # Emitted on the first paint after show(), i.e. when the overlay is on screen
+    shown = pyqtSignal()
+    
     def __init__(self, on_region_selected: Callable, logger=None):
         super().__init__()
         self.on_region_selected = on_region_selected
         self.logger = logger
         self.selection_start: Optional[QPoint] = None
         self.selection_end: Optional[QPoint] = None
-        self.screenshot: Optional[QPixmap] = None
+        # Raw BGRA grab and a QImage wrapping it (no copy, no PNG round trip)
+        self._raw: Optional[bytearray] = None
+        self._raw_size = (0, 0)
+        self.screenshot: Optional[QImage] = None
         self.is_selecting = False
+        self._first_paint = False
+        # Optional (x1, y1, x2, y2) -> PIL image; grabs the selection fresh
+        # from the screen at release instead of cropping the overlay grab
+        self.region_grabber: Optional[Callable] = None
         
         if self.logger:
             self.logger.debug("CaptureOverlay initialized")
@@ -46,84 +60,160 @@ class CaptureOverlay(QWidget):
         self.setCursor(Qt.CursorShape.CrossCursor)
         
     def start_capture(self):
-        """Capture screen and show overlay"""
+        """Capture screen and show overlay
+        
+        Standalone path (one mss handle per capture); DocShot itself goes
+        through CaptureEngine, which keeps the handle and geometry around.
+        """
         # CRITICAL FIX: Capture screen FIRST (before showing overlay)
         # This prevents the overlay from being captured in the screenshot
-        self.capture_screen()
-        
-        # Small delay to ensure capture is complete
-        from PyQt6.QtCore import QTimer
-        QTimer.singleShot(100, self._show_overlay)
+        # The grab is synchronous, so the overlay can be shown right away
+        if self.capture_screen():
+            self.show_overlay()
     
-    def _show_overlay(self):
-        """Show the overlay after capture"""
+    def show_overlay(self, desktop: Optional[QRect] = None):
+        """Show the overlay over desktop (default: the whole virtual desktop)
+        
+        Call after the screen has been grabbed into the overlay.
+        """
         # CRITICAL FIX: Re-apply geometry right before showing
         # Sometimes Qt resets it to primary screen only
-        from PyQt6.QtWidgets import QApplication
-        desktop = QApplication.primaryScreen().virtualGeometry()
-        self.setGeometry(desktop)
+        if desktop is None:
+            from PyQt6.QtWidgets import QApplication
+            desktop = QApplication.primaryScreen().virtualGeometry()
+        if self.geometry() != desktop:
+            self.setGeometry(desktop)
         
         print(f"Overlay geometry: {desktop.x()}, {desktop.y()}, {desktop.width()}x{desktop.height()}")
         
+        self._first_paint = True
         self.show()
         self.raise_()
         self.activateWindow()
     
-    def capture_screen(self):
+    def capture_screen(self) -> bool:
         """Capture full screen using mss - ALL MONITORS"""
         try:
-            from PyQt6.QtCore import QBuffer, QIODevice
-            from io import BytesIO
-            
             with mss() as sct:
                 # CRITICAL FIX: Capture ALL monitors (monitor 0 = all screens combined)
                 monitor = sct.monitors[0]  # 0 = All monitors as one virtual screen
-                screenshot = sct.grab(monitor)
-                
-                # Convert to PIL Image
-                img = Image.frombytes('RGB', screenshot.size, screenshot.rgb)
-                
-                # Validate image
-                if img.width == 0 or img.height == 0:
-                    print("Error: Invalid image dimensions")
-                    return
-                
-                print(f"Captured ALL monitors: {img.width}x{img.height}")
-                
-                # Convert PIL to QPixmap using in-memory buffer (no file system!)
-                byte_array = BytesIO()
-                img.save(byte_array, format='PNG')
-                byte_array.seek(0)
-                
-                # Load directly from bytes
-                self.screenshot = QPixmap()
-                self.screenshot.loadFromData(byte_array.read())
-                
-                # Validate QPixmap loaded successfully
-                if self.screenshot.isNull():
-                    print("Error: Failed to load QPixmap")
-                    return
-                
-                print(f"QPixmap loaded: {self.screenshot.width()}x{self.screenshot.height()}")
-                    
+                return self.grab_monitor(sct, monitor)
         except Exception as e:
             print(f"Error capturing screen: {e}")
             import traceback
             traceback.print_exc()
+            return False
+    
+    def grab_monitor(self, sct, monitor: dict) -> bool:
+        """Grab a monitor area with an open mss handle
+        
+        The BGRA buffer from mss is kept as is and wrapped in a QImage
+        (Format_RGB32 has the same byte layout on little-endian machines),
+        so no conversion or encoding happens until a region is selected.
+        """
+        screenshot = sct.grab(monitor)
+        
+        width, height = screenshot.size
+        
+        # Validate image
+        if width == 0 or height == 0:
+            print("Error: Invalid image dimensions")
+            return False
+        
+        self._raw = screenshot.raw
+        self._raw_size = (width, height)
+        
+        # QImage over the same memory; _raw must outlive it
+        self.screenshot = QImage(
+            self._raw, width, height, width * 4, QImage.Format.Format_RGB32
+        )
+        
+        print(f"Captured {width}x{height} at {monitor.get('left', 0)}, {monitor.get('top', 0)}")
+        return True
+    
+    def to_buffer_rect(self, x1: int, y1: int, x2: int, y2: int):
+        """Map widget coordinates to grab pixels
+        
+        The overlay is sized in logical pixels while mss grabs physical
+        ones; they differ on scaled (HiDPI) screens.
+        """
+        width, height = self._raw_size
+        if self.width() <= 0 or self.height() <= 0 or not width:
+            return x1, y1, x2, y2
+        sx = width / self.width()
+        sy = height / self.height()
+        return round(x1 * sx), round(y1 * sy), round(x2 * sx), round(y2 * sy)
+    
+    def crop_region(self, x1: int, y1: int, x2: int, y2: int) -> Optional[Image.Image]:
+        """Cut a region out of the raw grab as an RGB PIL image
+        
+        Only the selected rows and columns are copied and converted
+        (BGRX -> RGB); the rest of the desktop is never touched.
+        """
+        if self._raw is None:
+            return None
+        width, height = self._raw_size
+        x1, x2 = max(0, x1), min(width, x2)
+        y1, y2 = max(0, y1), min(height, y2)
+        if x2 <= x1 or y2 <= y1:
+            return None
+        
+        stride = width * 4
+        raw = memoryview(self._raw)
+        start, end = x1 * 4, x2 * 4
+        if x1 == 0 and x2 == width:
+            rows = raw[y1 * stride:y2 * stride]
+        else:
+            rows = b"".join(raw[y * stride + start:y * stride + end] for y in range(y1, y2))
+        return Image.frombytes("RGB", (x2 - x1, y2 - y1), bytes(rows), "raw", "BGRX")
+    
+    def _selection_rect(self) -> Optional[QRect]:
+        """Current selection in widget coordinates"""
+        if not (self.selection_start and self.selection_end):
+            return None
+        x1 = min(self.selection_start.x(), self.selection_end.x())
+        y1 = min(self.selection_start.y(), self.selection_end.y())
+        x2 = max(self.selection_start.x(), self.selection_end.x())
+        y2 = max(self.selection_start.y(), self.selection_end.y())
+        return QRect(x1, y1, x2 - x1, y2 - y1)
+    
+    def _dimension_text(self, rect: QRect) -> str:
+        return f"{rect.width()} × {rect.height()}"
+    
+    def _selection_bounds(self) -> QRect:
+        """Everything paintEvent draws for the selection: area, border, label"""
+        rect = self._selection_rect()
+        if rect is None:
+            return QRect()
+        bounds = rect.adjusted(-2, -2, 2, 2)  # Border pen straddles the edge
+        if rect.width() > 0 and rect.height() > 0:
+            label = self.fontMetrics().boundingRect(self._dimension_text(rect))
+            bounds = bounds.united(label.translated(rect.x() + 5, rect.y() - 5).adjusted(-1, -1, 1, 1))
+        return bounds
+    
+    def _update_selection(self, end: QPoint, start: Optional[QPoint] = None):
+        """Move the selection and repaint only what changed
+        
+        The overlay spans every monitor, so a full update() per mouse move
+        would recomposite tens of megapixels; the old and new selection
+        bounds are all that can differ.
+        """
+        dirty = self._selection_bounds()
+        if start is not None:
+            self.selection_start = start
+        self.selection_end = end
+        self.update(dirty.united(self._selection_bounds()))
     
     def mousePressEvent(self, event):
         """Start region selection"""
         if event.button() == Qt.MouseButton.LeftButton:
-            self.selection_start = event.pos()
-            self.selection_end = event.pos()
             self.is_selecting = True
-            self.update()
+            self._update_selection(event.pos(), start=event.pos())
     
     def mouseMoveEvent(self, event):
         """Update region selection"""
         if self.is_selecting:
-            self.selection_end = event.pos()
-            self.update()
+            self._update_selection(event.pos())
     
     def mouseReleaseEvent(self, event):
         """Finish region selection"""
@@ -138,27 +228,40 @@ class CaptureOverlay(QWidget):
                 x2 = max(self.selection_start.x(), self.selection_end.x())
                 y2 = max(self.selection_start.y(), self.selection_end.y())
                 
-                # Crop the screenshot
-                if self.screenshot and x2 > x1 and y2 > y1:
-                    cropped = self.screenshot.copy(x1, y1, x2 - x1, y2 - y1)
-                    
-                    # Convert QPixmap to PIL Image using in-memory buffer (no temp file!)
-                    from PyQt6.QtCore import QBuffer, QIODevice
-                    from io import BytesIO
+                if self.screenshot is not None and x2 > x1 and y2 > y1:
+                    region = self.to_buffer_rect(x1, y1, x2, y2)
                     
-                    buffer = QBuffer()
-                    buffer.open(QIODevice.OpenModeFlag.WriteOnly)
-                    cropped.save(buffer, "PNG")
+                    if self.region_grabber is not None:
+                        # Hide first so the dim layer is not in the re-grab
+                        self.close()
+                        from PyQt6.QtCore import QTimer
+                        QTimer.singleShot(REGRAB_DELAY_MS, lambda: self._finish_regrab(region))
+                        return
                     
-                    pil_img = Image.open(BytesIO(buffer.data()))
+                    # Crop straight from the raw grab
+                    pil_img = self.crop_region(*region)
                     
                     # Pass to callback
-                    self.on_region_selected(pil_img)
+                    if pil_img is not None:
+                        self.on_region_selected(pil_img)
             
             # Close overlay
             self.close()
             self.reset()
     
+    def _finish_regrab(self, region):
+        """Grab the selection fresh, falling back to the overlay grab"""
+        pil_img = None
+        try:
+            pil_img = self.region_grabber(*region)
+        except Exception as e:
+            print(f"Error re-grabbing region: {e}")
+        if pil_img is None:
+            pil_img = self.crop_region(*region)
+        self.reset()
+        if pil_img is not None:
+            self.on_region_selected(pil_img)
+    
     def keyPressEvent(self, event):
         """Handle escape key to cancel"""
         if event.key() == Qt.Key.Key_Escape:
@@ -171,22 +274,24 @@ class CaptureOverlay(QWidget):
         self.selection_end = None
         self.is_selecting = False
         self.screenshot = None
+        self._raw = None
     
     def paintEvent(self, event):
         """Draw semi-transparent overlay and selection rectangle"""
         painter = QPainter(self)
         
-        # Draw dark semi-transparent background
-        painter.fillRect(self.rect(), QColor(0, 0, 0, 120))
+        if self._first_paint:
+            self._first_paint = False
+            self.shown.emit()
+        
+        # Draw dark semi-transparent background (only the dirty part; Qt
+        # clears it to transparent first on translucent windows)
+        painter.fillRect(event.rect(), QColor(0, 0, 0, 120))
         
         # Draw selection rectangle if active
-        if self.selection_start and self.selection_end:
-            x1 = min(self.selection_start.x(), self.selection_end.x())
-            y1 = min(self.selection_start.y(), self.selection_end.y())
-            x2 = max(self.selection_start.x(), self.selection_end.x())
-            y2 = max(self.selection_start.y(), self.selection_end.y())
-            
-            selection_rect = QRect(x1, y1, x2 - x1, y2 - y1)
+        selection_rect = self._selection_rect()
+        if selection_rect is not None:
+            x1, y1 = selection_rect.x(), selection_rect.y()
             
             # Clear the selected area (show underlying screenshot)
             painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
@@ -199,7 +304,7 @@ class CaptureOverlay(QWidget):
             painter.drawRect(selection_rect)
             
             # Draw dimension label
-            if x2 - x1 > 0 and y2 - y1 > 0:
-                dimension_text = f"{x2 - x1} × {y2 - y1}"
+            if selection_rect.width() > 0 and selection_rect.height() > 0:
+                dimension_text = self._dimension_text(selection_rect)
                 painter.setPen(QColor(255, 255, 255))
                 painter.drawText(x1 + 5, y1 - 5, dimension_text)
@@ -5,11 +5,19 @@ from PyQt6.QtWidgets import QListWidget, QListWidgetItem, QMessageBox
 from PyQt6.QtCore import Qt, pyqtSignal
 
 
+# Item data roles holding the entry id and full title behind each row
+ENTRY_ID_ROLE = Qt.ItemDataRole.UserRole
+ENTRY_TITLE_ROLE = Qt.ItemDataRole.UserRole + 1
+ENTRY_SAVING_ROLE = Qt.ItemDataRole.UserRole + 2  # True until the entry is committed
+
+
 class DraggableEntryList(QListWidget):
     """QListWidget with drag-and-drop reordering support"""
     
-    # Signal emitted when order changes
-    order_changed = pyqtSignal()
+    # Signal emitted when one entry moves: (from_row, to_row)
+    entry_moved = pyqtSignal(int, int)
+    # Signal emitted when a row that is still saving was asked to move: (row)
+    entry_busy = pyqtSignal(int)
     
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -45,31 +53,81 @@ class DraggableEntryList(QListWidget):
             }
         """)
     
+    def add_entry(self, entry_id: str, title: str, saving: bool = False):
+        """Append a row for an entry, numbered by its position
+        
+        Rows added with saving=True stand for entries the save pipeline has
+        not committed yet; they cannot be dragged until set_saved().
+        """
+        item = QListWidgetItem()
+        item.setData(ENTRY_ID_ROLE, entry_id)
+        item.setData(ENTRY_TITLE_ROLE, title)
+        item.setData(ENTRY_SAVING_ROLE, saving)
+        if saving:
+            item.setFlags(item.flags() & ~Qt.ItemFlag.ItemIsDragEnabled)
+        item.setText(self.format_label(self.count() + 1, title, saving))
+        self.addItem(item)
+    
+    @staticmethod
+    def format_label(number: int, title: str, saving: bool = False) -> str:
+        """Row text: "#number - title", with long titles truncated"""
+        display = f"#{number} - {title[:50]}"
+        if len(title) > 50:
+            display += "..."
+        if saving:
+            display += " (saving...)"
+        return display
+    
+    def renumber(self):
+        """Re-derive the dense "#n" labels from the current row order"""
+        for i in range(self.count()):
+            item = self.item(i)
+            label = self.format_label(i + 1, item.data(ENTRY_TITLE_ROLE) or "",
+                                      bool(item.data(ENTRY_SAVING_ROLE)))
+            if item.text() != label:
+                item.setText(label)
+    
+    def entry_id(self, row: int):
+        """Entry id behind a row, or None"""
+        item = self.item(row)
+        return item.data(ENTRY_ID_ROLE) if item else None
+    
+    def is_saving(self, row: int) -> bool:
+        """True if the row's entry is still being saved"""
+        item = self.item(row)
+        return bool(item and item.data(ENTRY_SAVING_ROLE))
+    
+    def set_saved(self, entry_id: str):
+        """Mark an entry's row as committed (no-op if it is not listed)"""
+        for row in range(self.count()):
+            item = self.item(row)
+            if item.data(ENTRY_ID_ROLE) == entry_id:
+                item.setData(ENTRY_SAVING_ROLE, False)
+                item.setFlags(item.flags() | Qt.ItemFlag.ItemIsDragEnabled)
+                item.setText(self.format_label(row + 1, item.data(ENTRY_TITLE_ROLE) or ""))
+                return
+    
     def dropEvent(self, event):
         """Handle drop event and emit signal"""
+        moved_id = self.entry_id(self.currentRow())
+        from_row = self.currentRow()
         super().dropEvent(event)
-        # Order has changed, emit signal
-        self.order_changed.emit()
+        
+        # Find where the dragged entry landed
+        for row in range(self.count()):
+            if self.entry_id(row) == moved_id:
+                if row != from_row:
+                    self.renumber()
+                    self.entry_moved.emit(from_row, row)
+                break
     
     def get_entry_ids(self):
-        """Extract entry IDs from list items in current order
+        """Entry IDs of the list items in current order
         
         Returns:
             list: List of entry IDs in display order
         """
-        entry_ids = []
-        for i in range(self.count()):
-            item = self.item(i)
-            text = item.text()
-            # Extract ID from format: "#1 - Title" or just "Title"
-            if text.startswith('#'):
-                try:
-                    # Format: "#index - Title"
-                    idx = int(text.split(' - ')[0].replace('#', ''))
-                    entry_ids.append(idx - 1)  # Convert to 0-based index
-                except:
-                    pass
-        return entry_ids
+        return [self.entry_id(i) for i in range(self.count())]
     
     def keyPressEvent(self, event):
         """Handle keyboard shortcuts for reordering"""
@@ -100,6 +158,9 @@ class DraggableEntryList(QListWidget):
             return
         if to_row < 0 or to_row >= self.count():
             return
+        if self.is_saving(from_row):
+            self.entry_busy.emit(from_row)
+            return
         
         # Take item from source
         item = self.takeItem(from_row)
@@ -111,4 +172,5 @@ class DraggableEntryList(QListWidget):
         self.setCurrentRow(to_row)
         
         # Emit order changed signal
-        self.order_changed.emit()
+        self.renumber()
+        self.entry_moved.emit(from_row, to_row)
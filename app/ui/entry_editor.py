@@ -171,7 +171,7 @@ class QuickRenumberDialog(QDialog):
         """Setup the dialog UI"""
         layout = QVBoxLayout(self)
         
-        # Info
+        # Info (numbers are always 1-N in list order; nothing to choose)
         info = QLabel(
             f"Reset all entry numbers to sequential order (1-{self.total_entries})\n\n"
             "This will renumber all entries based on their current order."
@@ -179,38 +179,6 @@ class QuickRenumberDialog(QDialog):
         info.setWordWrap(True)
         layout.addWidget(info)
         
-        # Options
-        form = QFormLayout()
-        
-        self.spin_start = QSpinBox()
-        self.spin_start.setMinimum(1)
-        self.spin_start.setMaximum(9999)
-        self.spin_start.setValue(1)
-        self.spin_start.setToolTip("Starting number for renumbering")
-        form.addRow("Start from:", self.spin_start)
-        
-        layout.addLayout(form)
-        
-        # Preview
-        preview_group = QGroupBox("Preview")
-        preview_layout = QVBoxLayout()
-        
-        preview_text = QLabel(
-            f"Entry 1 → #{self.spin_start.value()}\n"
-            f"Entry 2 → #{self.spin_start.value() + 1}\n"
-            f"Entry 3 → #{self.spin_start.value() + 2}\n"
-            "..."
-        )
-        preview_text.setStyleSheet("font-family: monospace; color: #666;")
-        self.preview_label = preview_text
-        preview_layout.addWidget(preview_text)
-        
-        preview_group.setLayout(preview_layout)
-        layout.addWidget(preview_group)
-        
-        # Update preview when start changes
-        self.spin_start.valueChanged.connect(self.update_preview)
-        
         # Buttons
         button_box = QDialogButtonBox(
             QDialogButtonBox.StandardButton.Ok | 
@@ -219,16 +187,3 @@ class QuickRenumberDialog(QDialog):
         button_box.accepted.connect(self.accept)
         button_box.rejected.connect(self.reject)
         layout.addWidget(button_box)
-    
-    def update_preview(self, value):
-        """Update the preview text"""
-        self.preview_label.setText(
-            f"Entry 1 → #{value}\n"
-            f"Entry 2 → #{value + 1}\n"
-            f"Entry 3 → #{value + 2}\n"
-            "..."
-        )
-    
-    def get_start_number(self):
-        """Get the starting number"""
-        return self.spin_start.value()
@@ -0,0 +1,47 @@
+"""
+Process-wide font lookup for annotation text
+
+Text annotations are drawn with QFont both on the canvas and when burned
+into the saved image (see AnnotationRenderer). Fonts are built once and
+memoized here (image fonts per pixel size), so rendering text never builds
+or resolves a font again. warm_up() runs at startup; everything also
+resolves lazily on first use.
+"""
+from functools import lru_cache
+
+from PyQt6.QtGui import QFont, QFontMetrics
+
+# Annotation text
+TEXT_FONT_FAMILY = "Arial"  # Qt substitutes a close match where missing
+TEXT_FONT_SIZE = 14  # Canvas, in points
+
+
+@lru_cache(maxsize=1)
+def text_qfont() -> QFont:
+    """Canvas annotation font (QPainter.setFont copies it)"""
+    return QFont(TEXT_FONT_FAMILY, TEXT_FONT_SIZE, QFont.Weight.Bold)
+
+
+@lru_cache(maxsize=1)
+def text_metrics() -> QFontMetrics:
+    """Metrics for text_qfont(), for bounding boxes outside paintEvent"""
+    return QFontMetrics(text_qfont())
+
+
+@lru_cache(maxsize=32)
+def image_qfont(pixel_size: int) -> QFont:
+    """Font for text burned into a saved image, sized in image pixels"""
+    font = QFont(TEXT_FONT_FAMILY)
+    font.setPixelSize(pixel_size)
+    font.setWeight(QFont.Weight.Bold)
+    return font
+
+
+def warm_up(sizes=(24, 32)):
+    """Resolve fonts ahead of the first text annotation
+
+    Needs a QApplication.
+    """
+    text_metrics()
+    for size in sizes:
+        QFontMetrics(image_qfont(size))
@@ -6,7 +6,8 @@ from PyQt6.QtWidgets import (
     QMainWindow, QWidget, QFileDialog, QVBoxLayout, QHBoxLayout, 
     QPushButton, QLabel, QTextEdit, QComboBox, QListWidget, 
     QSplitter, QMessageBox, QStatusBar, QLineEdit, QFrame,
-    QToolButton, QMenu, QDialog  # V3.5.4: For reordering and editing
+    QToolButton, QMenu, QDialog,  # V3.5.4: For reordering and editing
+    QApplication, QCheckBox
 )
 from PyQt6.QtCore import Qt, QTimer
 from PyQt6.QtGui import QKeySequence, QShortcut
@@ -19,6 +20,7 @@ from app.ui.annotation_toolbar import AnnotationToolbar
 from app.ui.stats_panel import StatsPanel  # V3.5
 from app.ui.draggable_entry_list import DraggableEntryList  # V3.5.4
 from app.ui.entry_editor import EntryEditorDialog, QuickRenumberDialog  # V3.5.4
+from app.ui.save_pipeline import SavePipeline, SaveJob
 
 
 class MainWindow(QMainWindow):
@@ -36,6 +38,12 @@ class MainWindow(QMainWindow):
         self.annotation_toolbar = None
         self.current_filter = "All"  # V3.5: Track current filter
         
+        # Image rendering/encoding runs on a writer thread
+        self.save_pipeline = SavePipeline(logger=logger, parent=self)
+        self.save_pipeline.saved.connect(self.on_entry_saved)
+        self.save_pipeline.failed.connect(self.on_entry_save_failed)
+        self.saving_jobs = {}  # Entry id -> SaveJob not committed yet
+        
         if self.logger:
             self.logger.debug("MainWindow initializing...")
         
@@ -59,6 +67,20 @@ class MainWindow(QMainWindow):
         self.btn_capture.setEnabled(False)
         left_layout.addWidget(self.btn_capture)
         
+        # Capture modes (applied by the app's CaptureEngine)
+        self.chk_capture_monitor = QCheckBox("Capture screen under cursor only")
+        self.chk_capture_monitor.setToolTip(
+            "Grab and dim only the monitor the mouse is on instead of every screen"
+        )
+        left_layout.addWidget(self.chk_capture_monitor)
+        
+        self.chk_regrab = QCheckBox("Re-grab selection on release")
+        self.chk_regrab.setToolTip(
+            "Take the final image fresh from the screen when the selection is "
+            "released instead of cropping the snapshot taken at the hotkey"
+        )
+        left_layout.addWidget(self.chk_regrab)
+        
         # V3.5: Stats Panel
         self.stats_panel = StatsPanel(self)
         self.stats_panel.search_changed.connect(self.on_search_changed)
@@ -77,7 +99,8 @@ class MainWindow(QMainWindow):
         self.entry_list = DraggableEntryList()
         self.entry_list.itemClicked.connect(self.load_entry)
         self.entry_list.itemDoubleClicked.connect(self.edit_selected_entry)  # V3.5.4: Double-click to edit
-        self.entry_list.order_changed.connect(self.on_entry_order_changed)  # V3.5.4: Handle reordering
+        self.entry_list.entry_moved.connect(self.on_entry_moved)  # V3.5.4: Handle reordering
+        self.entry_list.entry_busy.connect(self.on_entry_busy)
         
         # V3.5.4: Context menu for right-click
         self.entry_list.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
@@ -131,6 +154,22 @@ class MainWindow(QMainWindow):
         self.btn_export.setEnabled(False)
         left_layout.addWidget(self.btn_export)
         
+        # Linked-assets HTML: images in assets/ instead of inline base64
+        self.chk_linked_assets = QCheckBox("Link images (faster, smaller HTML)")
+        self.chk_linked_assets.setToolTip(
+            "Write web-sized copies and thumbnails to an assets/ folder next to "
+            "report.html instead of embedding every image in the file"
+        )
+        left_layout.addWidget(self.chk_linked_assets)
+        
+        # Paginated HTML for very large sessions
+        self.chk_paginate = QCheckBox("Split HTML into pages")
+        self.chk_paginate.setToolTip(
+            "Write report_pages/ with an index page and one page per "
+            "100 entries instead of a single report.html"
+        )
+        left_layout.addWidget(self.chk_paginate)
+        
         left_panel.setLayout(left_layout)
         
         # Center panel: Canvas
@@ -293,6 +332,9 @@ class MainWindow(QMainWindow):
         (self.session_path / "images").mkdir(exist_ok=True)
         (self.session_path / "metadata").mkdir(exist_ok=True)
         
+        if self.store:
+            self.flush_saves()
+            self.store.close()
         self.store = SessionStore(self.session_path)
         self.load_session_entries()
         
@@ -312,14 +354,15 @@ class MainWindow(QMainWindow):
             return
         
         self.entry_list.clear()
-        entries = self.store.load_entries()
         
-        for i, entry in enumerate(entries, 1):
+        for entry in self.store.iter_headers():
             # V3.5: Show with number and truncated title
-            display = f"#{i} - {entry.title[:50]}"
-            if len(entry.title) > 50:
-                display += "..."
-            self.entry_list.addItem(display)
+            self.entry_list.add_entry(entry.id, entry.title)
+        
+        # Entries still on the save pipeline are committed at the end
+        for job in self.saving_jobs.values():
+            if job.store is self.store:
+                self.entry_list.add_entry(job.entry.id, job.entry.title, saving=True)
         
         # V3.5: Update stats panel and report name
         self.update_stats_panel()
@@ -331,14 +374,15 @@ class MainWindow(QMainWindow):
         if not self.store:
             return
         
-        # Parse entry number from display text
-        text = item.text()
+        row = self.entry_list.row(item)
+        if self.entry_list.is_saving(row):
+            self.on_entry_busy(row)
+            return
+        
+        # Materialize the full entry behind the clicked row
         try:
-            entry_num = int(text.split('#')[1].split(' -')[0])
-            entries = self.store.load_entries()
-            if 0 < entry_num <= len(entries):
-                entry = entries[entry_num - 1]
-                
+            entry = self.store.get_entry(self.entry_list.entry_id(row))
+            if entry is not None:
                 # Load image
                 img_path = self.session_path / entry.image.path
                 if img_path.exists():
@@ -485,7 +529,14 @@ class MainWindow(QMainWindow):
                 self.annotation_toolbar.select_tool(ToolType.ARROW)
     
     def save_entry(self):
-        """Save annotated entry (V3.5: Enhanced with split notes)"""
+        """Save annotated entry (V3.5: Enhanced with split notes)
+        
+        The list row appears immediately; rendering, JPEG encoding and the
+        image write run on the save pipeline's thread, and the entry is
+        committed in on_entry_saved() once its image is on disk. Until then
+        the row is marked as saving and cannot be opened, edited, deleted
+        or moved.
+        """
         try:
             if not self.store or self.canvas.pil_image is None:
                 self.update_status("Nothing to save")
@@ -495,18 +546,6 @@ class MainWindow(QMainWindow):
             if self.logger:
                 self.logger.info("Starting save_entry...")
             
-            # Render annotated image
-            if self.logger:
-                self.logger.info("Rendering annotated image...")
-            pil = self.canvas.render_annotated()
-            
-            # Save image
-            if self.logger:
-                self.logger.info("Saving image to disk...")
-            img_rel_path = self.store.save_image(pil)
-            if self.logger:
-                self.logger.info(f"Image saved to: {img_rel_path}")
-            
             # Get metadata
             title = self.title_edit.toPlainText().strip()
             details = self.details_edit.toPlainText().strip()
@@ -523,9 +562,10 @@ class MainWindow(QMainWindow):
             notes = self.notes_edit.toPlainText().strip()
             layout = self.layout_select.currentText()
             
-            # Create entry
+            # Create entry (annotations never change the image size)
             if self.logger:
                 self.logger.info(f"Creating entry with title: {title or 'Untitled'}")
+            pil = self.canvas.pil_image
             entry = Entry.new(
                 title=title or "Untitled",
                 details=details,
@@ -534,34 +574,27 @@ class MainWindow(QMainWindow):
                 notes=notes,
                 layout=layout,
                 image=ImageModel(
-                    path=str(img_rel_path),
+                    path="",
                     width=pil.width,
                     height=pil.height,
                     quality=95,
                     hires=True
                 )
             )
+            entry.image.path = str(self.store.reserve_image_path(entry.id))
             
-            # Save entry
-            if self.logger:
-                self.logger.info("Saving entry to storage...")
-            self.store.save_entry(entry)
-            if self.logger:
-                self.logger.info("Entry saved successfully")
-            
-            # V3.5: Update and save session metadata
-            self.store.metadata.report_title = self.report_name_edit.text().strip() or "Overlay Annotator Report"
-            self.store.metadata.entry_count = len(self.store.load_entries())
-            self.store.save_session_metadata()
-            
-            # Update list
-            entries = self.store.load_entries()
-            self.entry_list.addItem(f"#{len(entries)} - {entry.title[:50]}")
-            if self.logger:
-                self.logger.info(f"Entry list updated. Total entries: {len(entries)}")
+            # Hand rendering and the image write to the pipeline
+            job = SaveJob(
+                store=self.store,
+                entry=entry,
+                image=pil,
+                annotations=list(self.canvas.annotations),
+            )
+            self.saving_jobs[entry.id] = job
+            self.save_pipeline.submit(job)
             
-            # V3.5: Update stats panel
-            self.update_stats_panel()
+            # Update list right away
+            self.entry_list.add_entry(entry.id, entry.title, saving=True)
             
             # Clear form
             self.title_edit.clear()
@@ -574,13 +607,7 @@ class MainWindow(QMainWindow):
             if self.annotation_toolbar:
                 self.annotation_toolbar.hide()
             
-            self.update_status(f"Entry saved: {entry.title}")
-            
-            QMessageBox.information(
-                self,
-                "Saved",
-                f"Entry '{entry.title}' saved successfully!"
-            )
+            self.update_status(f"Saving entry: {entry.title}...")
             
         except Exception as e:
             if self.logger:
@@ -591,15 +618,78 @@ class MainWindow(QMainWindow):
                 f"Failed to save entry:\n\n{str(e)}\n\nCheck console for details."
             )
     
+    def on_entry_saved(self, job: SaveJob):
+        """Commit an entry once the pipeline has written its image"""
+        store = job.store
+        entry = job.entry
+        self.saving_jobs.pop(entry.id, None)
+        try:
+            # Save entry and session metadata in one commit
+            entry_count = store.entry_count() + 1
+            with store.batch():
+                store.save_entry(entry)
+                
+                # V3.5: Update and save session metadata
+                if store is self.store:
+                    store.metadata.report_title = self.report_name_edit.text().strip() or "Overlay Annotator Report"
+                store.metadata.entry_count = entry_count
+                store.save_session_metadata()
+            if self.logger:
+                self.logger.info(f"Entry saved successfully. Total entries: {entry_count}")
+        except Exception as e:
+            self.on_entry_save_failed(job, str(e))
+            return
+        
+        if store is self.store:
+            self.entry_list.set_saved(entry.id)
+            
+            # V3.5: Update stats panel
+            self.update_stats_panel()
+            self.update_status(f"Entry saved: {entry.title}")
+    
+    def on_entry_save_failed(self, job: SaveJob, error: str):
+        """Drop the row of an entry whose save failed and report it"""
+        self.saving_jobs.pop(job.entry.id, None)
+        if self.logger:
+            self.logger.error(f"Failed to save entry {job.entry.id}: {error}")
+        if job.store is self.store:
+            for row in range(self.entry_list.count()):
+                if self.entry_list.entry_id(row) == job.entry.id:
+                    self.entry_list.takeItem(row)
+                    self.entry_list.renumber()
+                    break
+        self.update_status(f"Save failed: {job.entry.title}")
+        QMessageBox.critical(
+            self,
+            "Save Failed",
+            f"Failed to save entry '{job.entry.title}':\n\n{error}\n\nCheck console for details."
+        )
+    
+    def flush_saves(self):
+        """Wait for queued saves and commit them before the store goes away"""
+        if self.save_pipeline.pending():
+            self.update_status("Finishing pending saves...")
+        self.save_pipeline.flush()
+        # Deliver the queued saved/failed signals now
+        QApplication.processEvents()
+    
     def export_report(self):
         """Export session report as both Markdown and HTML"""
         if not self.store:
             return
         
+        # Entries still on the save pipeline belong in the report
+        self.flush_saves()
+        
         try:
-            # Export both formats
-            md_path = self.store.export_markdown()
-            html_path = self.store.export_html()
+            # Export both formats in one pass over the entries
+            linked = self.chk_linked_assets.isChecked()
+            if self.chk_paginate.isChecked():
+                md_path = self.store.export_markdown()
+                html_path = self.store.export_html_pages(linked_assets=linked)
+            else:
+                paths = self.store.export(["md", "html"], linked_assets=linked)
+                md_path, html_path = paths["md"], paths["html"]
             
             self.update_status(f"Reports exported: {md_path.name} & {html_path.name}")
             
@@ -631,8 +721,11 @@ class MainWindow(QMainWindow):
     def update_stats_panel(self):
         """V3.5: Update stats panel with current data"""
         if self.store and hasattr(self, 'stats_panel'):
-            entries = self.store.load_entries()
-            self.stats_panel.update_stats(entries, self.store.metadata)
+            headers = list(self.store.iter_headers())
+            self.stats_panel.update_stats(
+                headers, self.store.metadata,
+                type_counts=self.store.count_by_location_type()
+            )
     
     def on_search_changed(self, search_text):
         """V3.5: Handle search text change"""
@@ -649,10 +742,8 @@ class MainWindow(QMainWindow):
         if not self.store:
             return
         
-        all_entries = self.store.load_entries()
-        filtered = all_entries
-        
-        # Apply location filter
+        # Apply location filter (answered by the storage backend)
+        target_type = None
         if filter_type != "All":
             type_map = {
                 "Web": "web",
@@ -661,26 +752,30 @@ class MainWindow(QMainWindow):
                 "Other": "other"
             }
             target_type = type_map.get(filter_type, "other")
-            filtered = [e for e in filtered if getattr(e, 'location_type', 'other') == target_type]
+        filtered = list(self.store.iter_headers(location_type=target_type))
         
-        # Apply search filter
+        # Entries still on the save pipeline are listed after the committed ones
+        saving = [job.entry for job in self.saving_jobs.values()
+                  if job.store is self.store and target_type in (None, job.entry.location_type)]
+        
+        # Apply search filter (needs the full entries for notes and details)
         if search_text:
             search_lower = search_text.lower()
-            filtered = [e for e in filtered if (
+            filtered = [self.store.get_entry(h.id) for h in filtered]
+            filtered = [e for e in filtered + saving if e is not None and (
                 search_lower in e.title.lower() or
                 search_lower in getattr(e, 'details', '').lower() or
                 search_lower in e.notes.lower() or
                 search_lower in getattr(e, 'location_url', '').lower()
             )]
+        else:
+            filtered += saving
         
         # Update entry list display
         self.entry_list.clear()
-        for i, entry in enumerate(filtered, 1):
+        for entry in filtered:
             # Show with number and truncated title
-            display = f"#{i} - {entry.title[:50]}"
-            if len(entry.title) > 50:
-                display += "..."
-            self.entry_list.addItem(display)
+            self.entry_list.add_entry(entry.id, entry.title, saving=entry.id in self.saving_jobs)
     
     def update_status(self, message: str):
         """Update status bar"""
@@ -724,17 +819,20 @@ class MainWindow(QMainWindow):
         
         if not self.store:
             return
+        if self.entry_list.is_saving(current_row):
+            self.on_entry_busy(current_row)
+            return
         
         try:
-            # Load all entries
-            entries = self.store.load_entries()
-            
-            # Apply current filter to get the correct entry
-            if current_row >= len(entries):
+            # Look up the entry behind the row (the list may be filtered)
+            entry_id = self.entry_list.entry_id(current_row)
+            entry = self.store.get_entry(entry_id)
+            if entry is None:
                 return
             
-            entry = entries[current_row]
-            entry_number = current_row + 1  # Display as 1-based
+            # Number = position in the full session order, 1-based
+            ids = [h.id for h in self.store.iter_headers()]
+            entry_number = ids.index(entry_id) + 1
             
             # Open editor dialog
             dialog = EntryEditorDialog(entry, entry_number, self)
@@ -742,17 +840,14 @@ class MainWindow(QMainWindow):
             if dialog.exec() == QDialog.DialogCode.Accepted:
                 updated_entry, new_number = dialog.get_updated_entry()
                 
-                # Check if number changed
-                if new_number != entry_number:
-                    # Update order field
-                    updated_entry.order = new_number
+                with self.store.batch():
+                    # Save updated entry
+                    self.store.save_entry(updated_entry)
                     
-                # Save updated entry
-                self.store.save_entry(updated_entry)
-                
-                # If order changed, renumber all entries
-                if new_number != entry_number:
-                    self.reorder_entries_by_list()
+                    # If the number changed, move the entry to that position
+                    if new_number != entry_number:
+                        self.store.move_entry(updated_entry.id, new_number - 1)
+                self.schedule_order_rebalance()
                 
                 # Refresh display
                 self.load_session_entries()
@@ -781,7 +876,7 @@ class MainWindow(QMainWindow):
             return
         
         try:
-            entries = self.store.load_entries()
+            entries = list(self.store.iter_headers())
             
             if not entries:
                 QMessageBox.information(
@@ -795,19 +890,16 @@ class MainWindow(QMainWindow):
             dialog = QuickRenumberDialog(len(entries), self)
             
             if dialog.exec() == QDialog.DialogCode.Accepted:
-                start_number = dialog.get_start_number()
-                
-                # Renumber all entries
-                for i, entry in enumerate(entries):
-                    entry.order = start_number + i
-                    self.store.save_entry(entry)
+                # Display numbers are derived from position; renumbering
+                # respaces the sparse order keys in the current order
+                self.store.rebalance_orders()
                 
                 # Refresh display
                 self.load_session_entries()
-                self.update_status(f"Renumbered {len(entries)} entries starting from #{start_number}")
+                self.update_status(f"Renumbered {len(entries)} entries")
                 
                 if self.logger:
-                    self.logger.info(f"Renumbered {len(entries)} entries (start: {start_number})")
+                    self.logger.info(f"Renumbered {len(entries)} entries")
         
         except Exception as e:
             if self.logger:
@@ -831,14 +923,15 @@ class MainWindow(QMainWindow):
         
         if not self.store:
             return
+        if self.entry_list.is_saving(current_row):
+            self.on_entry_busy(current_row)
+            return
         
         try:
-            entries = self.store.load_entries()
-            if current_row >= len(entries):
+            entry = self.store.get_entry(self.entry_list.entry_id(current_row))
+            if entry is None:
                 return
             
-            entry = entries[current_row]
-            
             # Confirm deletion
             reply = QMessageBox.question(
                 self,
@@ -868,52 +961,60 @@ class MainWindow(QMainWindow):
                 f"Could not delete entry: {str(e)}"
             )
     
-    def on_entry_order_changed(self):
-        """Handle entry order change from drag-and-drop (V3.5.4)"""
-        if self.logger:
-            self.logger.info("Entry order changed via drag-and-drop")
+    def on_entry_moved(self, from_row, to_row):
+        """Persist a single entry move from drag-and-drop or Ctrl+Up/Down (V3.5.4)
         
-        # Reorder entries based on new list order
-        self.reorder_entries_by_list()
-        self.update_status("Entries reordered")
-    
-    def reorder_entries_by_list(self):
-        """Reorder entries based on current list display order (V3.5.4)"""
+        Only the moved entry gets a new order key; the list rows are
+        already in place and renumbered by the list widget.
+        """
         if not self.store:
             return
         
         try:
-            entries = self.store.load_entries()
+            entry_id = self.entry_list.entry_id(to_row)
+            others = [h.id for h in self.store.iter_headers() if h.id != entry_id]
             
-            # Get new order from list (1-based display numbers)
-            for i in range(self.entry_list.count()):
-                item = self.entry_list.item(i)
-                text = item.text()
-                
-                # Extract original entry number from "#X - Title"
-                if text.startswith('#'):
-                    try:
-                        old_num = int(text.split(' - ')[0].replace('#', '').strip())
-                        if 1 <= old_num <= len(entries):
-                            # Set new order
-                            entries[old_num - 1].order = i + 1
-                    except:
-                        pass
-            
-            # Save all entries with new order
-            for entry in entries:
-                self.store.save_entry(entry)
-            
-            # Refresh display
-            self.load_session_entries()
+            # Place it after the nearest committed row above it (the list
+            # may be filtered, and rows still saving are not in the store)
+            new_index = 0
+            for row in range(to_row - 1, -1, -1):
+                above = self.entry_list.entry_id(row)
+                if above in others:
+                    new_index = others.index(above) + 1
+                    break
+            else:
+                for row in range(to_row + 1, self.entry_list.count()):
+                    below = self.entry_list.entry_id(row)
+                    if below in others:
+                        new_index = others.index(below)
+                        break
+            
+            self.store.move_entry(entry_id, new_index)
+            self.schedule_order_rebalance()
+            self.update_status("Entries reordered")
             
             if self.logger:
-                self.logger.info("Entries reordered and saved")
+                self.logger.info(f"Entry {entry_id} moved from row {from_row} to {to_row}")
         
         except Exception as e:
             if self.logger:
                 self.logger.error(f"Failed to reorder entries: {e}", exc_info=True)
     
+    def on_entry_busy(self, row):
+        """Tell the user a row's entry cannot be used until its save finishes"""
+        self.update_status("Entry is still saving - try again in a moment")
+    
+    def schedule_order_rebalance(self):
+        """Respace order keys once the event loop is idle, if moves used up the gaps"""
+        if self.store and self.store.needs_rebalance:
+            QTimer.singleShot(0, self._rebalance_orders)
+    
+    def _rebalance_orders(self):
+        if self.store and self.store.needs_rebalance:
+            self.store.rebalance_orders()
+            if self.logger:
+                self.logger.info("Entry order keys rebalanced")
+    
     def move_entry_up(self):
         """Move selected entry up in the list (V3.5.4)"""
         current_row = self.entry_list.currentRow()
@@ -932,4 +1033,7 @@ class MainWindow(QMainWindow):
         """Handle window close"""
         if self.annotation_toolbar:
             self.annotation_toolbar.close()
+        self.flush_saves()
+        if self.store:
+            self.store.close()
         event.accept()
@@ -0,0 +1,89 @@
+"""
+Background save pipeline for captured entries
+
+Rendering annotations into the screenshot and encoding the JPEG take well
+over a second on 4K crops, so MainWindow hands them to a single writer
+thread. Jobs run in submission order; completion and failure come back to
+the GUI thread through Qt signals, where the entry itself is committed to
+the SessionStore (which is only used from the GUI thread).
+"""
+import queue
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List
+
+from PyQt6.QtCore import QObject, pyqtSignal
+from PIL import Image
+
+from app.core.models import Entry
+from app.ui.annotation_canvas import Annotation, render_annotations
+
+
+@dataclass
+class SaveJob:
+    """Everything the writer thread needs, captured on the GUI thread"""
+    store: object  # SessionStore the entry belongs to
+    entry: Entry  # Fully built entry; image.path is already reserved
+    image: Image.Image  # Unannotated capture
+    annotations: List[Annotation]  # Snapshot; the canvas list is not shared
+
+    @property
+    def image_path(self) -> Path:
+        return Path(self.entry.image.path)
+
+
+class SavePipeline(QObject):
+    """Single writer thread rendering and writing entry images"""
+
+    # Signals (delivered on the GUI thread)
+    saved = pyqtSignal(object)  # SaveJob whose image is on disk
+    failed = pyqtSignal(object, str)  # SaveJob, error message
+
+    def __init__(self, logger=None, parent=None):
+        super().__init__(parent)
+        self.logger = logger
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="docshot-save", daemon=True)
+        self._thread.start()
+
+    def submit(self, job: SaveJob) -> None:
+        """Queue a job; returns immediately"""
+        self._queue.put(job)
+
+    def pending(self) -> int:
+        """Jobs queued or in progress"""
+        return self._queue.unfinished_tasks
+
+    def flush(self) -> None:
+        """Block until every queued job has been written"""
+        self._queue.join()
+
+    def shutdown(self) -> None:
+        """Flush, then stop the writer thread"""
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._write(job)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, job: SaveJob):
+        try:
+            pil = render_annotations(job.image, job.annotations)
+            job.store.write_image(pil, job.image_path)
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Background save failed for {job.entry.id}: {e}", exc_info=True)
+            self.failed.emit(job, str(e))
+            return
+        if self.logger:
+            self.logger.info(f"Image saved to: {job.image_path}")
+        self.saved.emit(job)
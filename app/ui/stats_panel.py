@@ -91,24 +91,32 @@ class StatsPanel(QWidget):
         
         self.setLayout(layout)
     
-    def update_stats(self, entries, metadata):
-        """Update statistics display"""
+    def update_stats(self, entries, metadata, type_counts=None):
+        """Update statistics display
+        
+        Args:
+            entries: Entries in display order
+            metadata: SessionMetadata for the report name and creation date
+            type_counts: Precomputed counts per location type; counted from
+                entries when not given
+        """
         count = len(entries)
         
         # Count by type
-        type_counts = {
-            "web": 0, 
-            "app": 0, 
-            "mobile": 0, 
-            "other": 0
-        }
-        
-        for entry in entries:
-            entry_type = getattr(entry, 'location_type', 'other')
-            if entry_type in type_counts:
-                type_counts[entry_type] += 1
-            else:
-                type_counts['other'] += 1
+        if type_counts is None:
+            type_counts = {
+                "web": 0, 
+                "app": 0, 
+                "mobile": 0, 
+                "other": 0
+            }
+            
+            for entry in entries:
+                entry_type = getattr(entry, 'location_type', 'other')
+                if entry_type in type_counts:
+                    type_counts[entry_type] += 1
+                else:
+                    type_counts['other'] += 1
         
         # Calculate duration
         if entries and len(entries) > 1:
@@ -0,0 +1,163 @@
+"""Micro-benchmark: burning annotations into a capture, PIL vs QPainter
+
+Builds an 8K (7680x4320) capture and 50 mixed annotations (arrows, boxes,
+freehand strokes, text) and times:
+
+- PIL ImageDraw: the renderer render_annotations used before
+  AnnotationRenderer, kept here verbatim apart from font lookup (memoized,
+  so only drawing is compared)
+- QPainter: AnnotationRenderer.for_image(...).render(), the current path,
+  including the PIL <-> QImage copies
+- QPainter (paint only): painting onto an existing QImage, without the
+  conversions, to show what they cost
+- QPainter (worker thread): render() on a thread, as the save pipeline
+  runs it
+
+Usage:
+    python bench_annotation_render.py [count] [width] [height]
+"""
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from array import array
+
+from PIL import Image, ImageDraw, ImageFont
+from PyQt6.QtCore import QPoint
+from PyQt6.QtGui import QColor, QImage, QPainter
+from PyQt6.QtWidgets import QApplication
+
+from app.ui.annotation_canvas import Annotation, ToolType
+from app.ui.annotation_renderer import AnnotationRenderer
+
+
+@lru_cache(maxsize=32)
+def legacy_font(size):
+    for candidate in ("arial.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"):
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def legacy_render(pil_image, annotations):
+    """render_annotations as it was with PIL ImageDraw"""
+    output = pil_image.copy()
+    draw = ImageDraw.Draw(output)
+    w, h = output.size
+    min_width = max(3, int(3 * (w / 1000)))
+
+    for annotation in annotations:
+        if annotation.tool == ToolType.TEXT and annotation.text:
+            x = int(annotation.start.x())
+            y = int(annotation.start.y())
+            font = legacy_font(max(24, int(32 * (h / 1000))))
+            bbox = draw.textbbox((x, y), annotation.text, font=font)
+            draw.rectangle(bbox, fill=(255, 255, 255, 220))
+            color = (annotation.color.red(), annotation.color.green(), annotation.color.blue())
+            draw.text((x, y), annotation.text, fill=color, font=font)
+
+        elif annotation.tool in [ToolType.ARROW, ToolType.BOX, ToolType.PEN]:
+            x1, y1 = int(annotation.start.x()), int(annotation.start.y())
+            x2, y2 = int(annotation.end.x()), int(annotation.end.y())
+            color = (annotation.color.red(), annotation.color.green(), annotation.color.blue())
+            width = max(min_width, int(annotation.width * (w / 1000)))
+
+            if annotation.tool == ToolType.BOX:
+                draw.rectangle([min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)],
+                               outline=color, width=width)
+            elif annotation.tool == ToolType.PEN and annotation.points is not None \
+                    and len(annotation.points) >= 4:
+                draw.line(annotation.points.tolist(), fill=color, width=width, joint="curve")
+            else:
+                draw.line([x1, y1, x2, y2], fill=color, width=width)
+                if annotation.tool == ToolType.ARROW:
+                    dx, dy = x2 - x1, y2 - y1
+                    length = (dx**2 + dy**2)**0.5
+                    if length > 0:
+                        dx, dy = dx/length, dy/length
+                        arrow_size = max(20, int(30 * (w / 1000)))
+                        draw.polygon([
+                            (x2, y2),
+                            (int(x2 - arrow_size * (dx + dy*0.5)), int(y2 - arrow_size * (dy - dx*0.5))),
+                            (int(x2 - arrow_size * (dx - dy*0.5)), int(y2 - arrow_size * (dy + dx*0.5))),
+                        ], fill=color)
+    return output
+
+
+def make_annotations(count, width, height):
+    tools = (ToolType.ARROW, ToolType.BOX, ToolType.PEN, ToolType.TEXT)
+    annotations = []
+    for i in range(count):
+        tool = tools[i % len(tools)]
+        x = (i * 797) % (width - 1200) + 100
+        y = (i * 463) % (height - 900) + 100
+        color = QColor(255, (i * 40) % 256, 0)
+        start, end = QPoint(x, y), QPoint(x + 900, y + 600)
+        if tool == ToolType.TEXT:
+            annotations.append(Annotation(tool, start, color=color, text=f"Step {i}: check this value"))
+            continue
+        annotation = Annotation(tool, start, end, color=color, width=3 + i % 5)
+        if tool == ToolType.PEN:
+            # 400-point scribble, as left by the canvas after simplification
+            annotation.points = array('i')
+            for k in range(400):
+                annotation.points.append(int(x + k * 2.25))
+                annotation.points.append(int(y + 300 + 250 * math.sin(k / 15)))
+            annotation.end = QPoint(annotation.points[-2], annotation.points[-1])
+        annotations.append(annotation)
+    return annotations
+
+
+def bench(label, run, repeat=3):
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    print(f"{label:<28} {elapsed * 1000:8.1f} ms")
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 7680
+    height = int(sys.argv[3]) if len(sys.argv) > 3 else 4320
+
+    app = QApplication.instance() or QApplication(sys.argv)  # noqa: F841 (fonts need it)
+    image = Image.new("RGBA", (width, height), (40, 120, 200, 255))
+    annotations = make_annotations(count, width, height)
+    renderer = AnnotationRenderer.for_image(width, height)
+
+    # Warm-up so neither side pays first-call costs (fonts, glyph caches)
+    legacy_render(image, annotations[:8])
+    renderer.render(image, annotations[:8])
+
+    print(f"{count} annotations on {width}x{height}, best of 3 runs")
+    print("-" * 44)
+    pil = bench("PIL ImageDraw", lambda: legacy_render(image, annotations))
+    qt = bench("QPainter render()", lambda: renderer.render(image, annotations))
+
+    target = QImage(width, height, QImage.Format.Format_RGBA8888)
+    target.fill(QColor(40, 120, 200))
+
+    def paint_only():
+        painter = QPainter(target)
+        renderer.paint(painter, annotations)
+        painter.end()
+
+    bench("QPainter (paint only)", paint_only)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        bench("QPainter (worker thread)", lambda: pool.submit(renderer.render, image, annotations).result())
+    print("-" * 44)
+    print(f"QPainter vs PIL: {pil / qt:.2f}x")
+
+
+if __name__ == "__main__":
+    main()